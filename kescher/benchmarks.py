@@ -0,0 +1,216 @@
+"""
+Benchmarks time the importers and reports of kescher on generated ledgers
+(see kescher.generators) of a given scale, i.e. number of journal rows.
+The results are written as JSON, s.t. versions can be compared:
+
+    $ kescher-benchmark --scale 10000 --scale 100000 --output results.json
+
+The startup time of the kescher command is measured, too. It has to stay
+within STARTUP_BUDGET, as kescher is called thousands of times by scripts.
+So has the import of a chart of about 20k accounts to stay within
+ACCOUNTS_BUDGET.
+"""
+import arrow
+import click
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+from importlib import metadata
+from kescher.booking import auto_book_vat, get_account_saldo
+from kescher.database import KESCHER_DB_NAME, get_db, get_pragmas
+from kescher.filters import UnbalancedFilter
+from kescher.generators import (
+    VAT_ACCOUNTS,
+    generate_accounts,
+    generate_bookings,
+    generate_invoices,
+    generate_journal,
+)
+from kescher.importers import (
+    AccountImporter,
+    DocumentImporter,
+    InvoiceImporter,
+    JournalImporter,
+)
+from kescher.migrations import migrate_database
+from kescher.models import Account, create_tables
+from kescher.show import show_accounts
+from pathlib import Path
+
+SCALES = (10_000, 100_000, 1_000_000)
+BATCH_SIZE = 100
+STARTUP_BUDGET = 0.2
+STARTUP_COMMANDS = (("--help",), ("book", "entry", "--help"), ("show", "--help"))
+ACCOUNTS_BUDGET = 1.0
+# 7 + 7^2 + ... + 7^5 expense accounts, 19622 accounts in total
+ACCOUNTS_DEPTH = 5
+ACCOUNTS_BREADTH = 7
+
+
+@contextmanager
+def timed(timings, name):
+    """
+    Stores the seconds spent in the block as timings[name].
+    """
+    start = time.perf_counter()
+    yield
+    timings[name] = round(time.perf_counter() - start, 4)
+
+
+@contextmanager
+def benchmark_database(path):
+    """
+    Points the database of kescher to path within the block.
+    """
+    database = get_db()
+    previous = database.database
+    database.close()
+    database.init(str(path), pragmas=get_pragmas())
+    try:
+        yield database
+    finally:
+        database.close()
+        database.init(previous, pragmas=get_pragmas())
+
+
+def run_benchmarks(scale, workdir, seed=0):
+    """
+    Generates a ledger of scale journal rows (with scale / 100 invoices) in
+    workdir, imports it into a new database there and times each step.
+    Returns the timings in seconds by name.
+    """
+    workdir = Path(workdir)
+    n_customers = max(10, scale // 1000)
+    n_invoices = max(1, scale // 100)
+    journal_path = workdir / "journal.csv"
+    accounts_path = workdir / "accounts.yaml"
+    invoices_path = workdir / "invoices"
+    generate_journal(journal_path, scale, seed)
+    expense_accounts = generate_accounts(accounts_path, n_customers=n_customers)
+    generate_invoices(invoices_path, n_invoices, n_customers, seed)
+
+    timings = {}
+    with benchmark_database(workdir / KESCHER_DB_NAME) as database:
+        migrate_database(database)
+        create_tables()
+        with timed(timings, "import_accounts"), open(accounts_path) as account_file:
+            AccountImporter(account_file)()
+        with timed(timings, "import_journal"), open(journal_path) as journal_file:
+            JournalImporter(journal_file, batch_size=BATCH_SIZE)()
+        with timed(timings, "import_documents"):
+            DocumentImporter(invoices_path, flat=False)()
+        with timed(timings, "import_invoices"):
+            InvoiceImporter(invoices_path, "cid", "total_gross", "date")()
+        with timed(timings, "book_vat"):
+            auto_book_vat(19, *VAT_ACCOUNTS)
+        account_ids = [
+            account.id
+            for account in Account.select(Account.id).where(
+                Account.name.in_(expense_accounts)
+            )
+        ]
+        with timed(timings, "generate_bookings"):
+            generate_bookings(account_ids, seed=seed)
+        with timed(timings, "get_account_saldo"):
+            get_account_saldo("Aufwendungen")
+        with timed(timings, "get_account_saldo_range"):
+            get_account_saldo(
+                "Aufwendungen", arrow.get("2019-02-15"), arrow.get("2019-11-15")
+            )
+        with timed(timings, "show_accounts"):
+            list(show_accounts())
+        with timed(timings, "show_unbalanced"):
+            for _ in UnbalancedFilter()(None, 80):
+                pass
+    return timings
+
+
+def time_account_import(workdir, depth=ACCOUNTS_DEPTH, breadth=ACCOUNTS_BREADTH):
+    """
+    Imports a generated chart of accounts into a new database in workdir and
+    returns the seconds spent.
+    """
+    workdir = Path(workdir)
+    accounts_path = workdir / "accounts.yaml"
+    generate_accounts(accounts_path, depth, breadth)
+    timings = {}
+    with benchmark_database(workdir / KESCHER_DB_NAME):
+        create_tables()
+        with timed(timings, "import_accounts"), open(accounts_path) as account_file:
+            AccountImporter(account_file)()
+    return timings["import_accounts"]
+
+
+def time_startup(args, repeat=5):
+    """
+    Runs the kescher command with args repeat times in a new interpreter and
+    returns the median of the seconds spent.
+    """
+    command = [sys.executable, "-m", "kescher.cli", *args]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings), 4)
+
+
+@click.command()
+@click.option(
+    "--scale",
+    "scales",
+    type=click.IntRange(min=1),
+    multiple=True,
+    help=f"Number of journal rows, default {', '.join(map(str, SCALES))}.",
+)
+@click.option("--seed", type=click.INT, default=0)
+@click.option("--output", "-o", type=click.File("w"), default="-")
+def main(scales, seed, output):
+    """
+    Time the startup of kescher and the importers and reports on generated
+    ledgers.
+    """
+    startup = {" ".join(args): time_startup(args) for args in STARTUP_COMMANDS}
+    with tempfile.TemporaryDirectory() as workdir:
+        account_import = time_account_import(workdir)
+    runs = []
+    for scale in scales or SCALES:
+        with tempfile.TemporaryDirectory() as workdir:
+            runs.append(
+                {"scale": scale, "timings": run_benchmarks(scale, workdir, seed)}
+            )
+    try:
+        version = metadata.version("kescher")
+    except metadata.PackageNotFoundError:
+        version = None
+    results = {
+        "kescher": version,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seed": seed,
+        "startup_budget": STARTUP_BUDGET,
+        "startup": startup,
+        "accounts_budget": ACCOUNTS_BUDGET,
+        "account_import": account_import,
+        "runs": runs,
+    }
+    json.dump(results, output, indent=2)
+    output.write("\n")
+    for command, seconds in startup.items():
+        if seconds > STARTUP_BUDGET:
+            sys.exit(
+                f"Startup of 'kescher {command}' took {seconds}s, "
+                + f"the budget is {STARTUP_BUDGET}s."
+            )
+    if account_import > ACCOUNTS_BUDGET:
+        sys.exit(
+            f"Importing the chart of accounts took {account_import}s, "
+            + f"the budget is {ACCOUNTS_BUDGET}s."
+        )
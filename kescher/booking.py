@@ -1,46 +1,102 @@
 import logging
 
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from kescher.models import Account, Booking, JournalEntry, VirtualBooking
-from peewee import fn
+from kescher.models import (
+    Account,
+    AccountBalance,
+    AccountClosure,
+    AccountMonthBalance,
+    BalanceSnapshot,
+    Booking,
+    ClosedPeriod,
+    JournalEntry,
+    UNBALANCED_STATUSES,
+    VirtualBooking,
+)
+from peewee import Case, chunked, fn
 
+VAT_BATCH_SIZE = 100
+
+
+VatSummary = namedtuple(
+    "VatSummary",
+    ("n_in", "total_in", "n_out", "total_out", "n_already_booked", "n_locked"),
+)
 
-def auto_book_vat(percentage, vat_in_acc, vat_out_acc):
-    """
-    This function automatically books VAT for all journal entries.
 
-    TODO: Filtering by date/range and check for existing bookings
-    to prevent double booking.
+def auto_book_vat(
+    percentage, vat_in_acc, vat_out_acc, start_date=None, end_date=None, dry_run=False
+):
+    """
+    This function automatically books VAT for all journal entries (between
+    start_date and end_date, if given), which have no booking to one of the
+    VAT accounts yet. The entries are found with one anti-join and the
+    bookings are inserted in batches within one transaction. Entries dated
+    within a locked period are skipped. If dry_run is set, nothing is
+    written. Returns a VatSummary of the (to be) booked VAT.
     """
     logger = logging.getLogger("kescher.booking.auto_book_vat")
     vat_in_id = Account.get(Account.name == vat_in_acc).id
     vat_out_id = Account.get(Account.name == vat_out_acc).id
-    journalentries_with_vat = [
-        b.journalentry
-        for b in Booking.select().where(
-            (Booking.account == vat_in_id) | (Booking.account == vat_out_id)
+    vat_bookings = Booking.select(Booking.id).where(
+        (Booking.journalentry == JournalEntry.id)
+        & (Booking.account.in_([vat_in_id, vat_out_id]))
+    )
+    in_range = date_range(JournalEntry.date, as_date(start_date), as_date(end_date))
+
+    with Booking._meta.database.atomic():
+        n_already_booked = (
+            JournalEntry.select().where(in_range & fn.EXISTS(vat_bookings)).count()
         )
-    ]
-    for je in JournalEntry.select():
-        if je in journalentries_with_vat:
-            print(f"VAT already booked for {je.id} ({je.date})")
-            continue
-        if je.value > 0:
+        logger.debug(f"VAT already booked for {n_already_booked} entries.")
+        unbooked = in_range & ~fn.EXISTS(vat_bookings) & (JournalEntry.value != 0)
+        locked = ClosedPeriod.locking(JournalEntry.date)
+        n_locked = JournalEntry.select().where(unbooked & locked).count()
+        logger.debug(f"Skipping {n_locked} entries in locked periods.")
+        unbooked = JournalEntry.select(JournalEntry.id, JournalEntry.value).where(
+            unbooked & ~locked
+        )
+        bookings = []
+        n_in = n_out = 0
+        total_in = total_out = Decimal("0.00")
+        for je_id, je_value in unbooked.tuples():
             booking_value = round(
-                je.value - (je.value * 100) / (100 + Decimal(percentage)), 2
-            )
-            Booking.create(
-                value=booking_value, account_id=vat_in_id, journalentry_id=je.id,
-            )
-            logger.debug(f"Added Booking of {booking_value} to {vat_in_acc}.")
-        elif je.value < 0:
-            booking_value = -round(
-                je.value - (je.value * 100) / (100 + Decimal(percentage)), 2
+                je_value - (je_value * 100) / (100 + Decimal(percentage)), 2
             )
-            Booking.create(
-                value=booking_value, account_id=vat_out_id, journalentry_id=je.id,
-            )
-            logger.debug(f"Added Booking of {booking_value} to {vat_out_acc}.")
+            if je_value > 0:
+                bookings.append((booking_value, vat_in_id, je_id))
+                n_in += 1
+                total_in += booking_value
+            else:
+                bookings.append((-booking_value, vat_out_id, je_id))
+                n_out += 1
+                total_out -= booking_value
+        summary = VatSummary(
+            n_in, total_in, n_out, total_out, n_already_booked, n_locked
+        )
+        if dry_run:
+            return summary
+
+        updated_at = datetime.now().astimezone()
+        for batch in chunked(bookings, VAT_BATCH_SIZE):
+            Booking.insert_many(
+                [booking + (updated_at,) for booking in batch],
+                fields=[
+                    Booking.value,
+                    Booking.account,
+                    Booking.journalentry,
+                    Booking.updated_at,
+                ],
+            ).execute()
+        logger.debug(
+            f"Added {summary.n_in} bookings of {summary.total_in} to {vat_in_acc}."
+        )
+        logger.debug(
+            f"Added {summary.n_out} bookings of {summary.total_out} to {vat_out_acc}."
+        )
+    return summary
 
 
 def book_entry(value, comment, journalentry_id, account_name, force):
@@ -50,14 +106,7 @@ def book_entry(value, comment, journalentry_id, account_name, force):
     logger = logging.getLogger("kescher.booking.auto_book_vat")
     account = Account.get(Account.name == account_name)
     journalentry = JournalEntry.get_by_id(journalentry_id)
-    booked = (
-        Booking.select(fn.SUM(Booking.value))
-        .where(Booking.journalentry == journalentry)
-        .scalar()
-    )
-    if booked is None:
-        booked = Decimal("0.0")
-    remaining = abs(journalentry.value) - Decimal(booked)
+    remaining = round(abs(journalentry.value) - journalentry.booked, 2)
     if not remaining and not force:
         raise ValueError("No remaining value to be booked")
 
@@ -80,79 +129,236 @@ def book_entry(value, comment, journalentry_id, account_name, force):
     return new_booking
 
 
+def get_unbalanced_summary():
+    """
+    Returns the number of entries and the total amount per status of the
+    unbalanced journal entries (read via the status index): the amount left
+    to book, for overbooked entries the amount booked too much.
+    """
+    return {
+        status: (count, to_decimal(total))
+        for status, count, total in JournalEntry.select(
+            JournalEntry.status,
+            fn.COUNT(JournalEntry.id),
+            fn.SUM(
+                Case(
+                    JournalEntry.status,
+                    [("overbooked", JournalEntry.booked - fn.abs(JournalEntry.value))],
+                    fn.abs(JournalEntry.value) - JournalEntry.booked,
+                )
+            ),
+        )
+        .where(JournalEntry.status.in_(UNBALANCED_STATUSES))
+        .group_by(JournalEntry.status)
+        .tuples()
+    }
+
+
+def close_period(year, lock=False):
+    """
+    Closes the fiscal year: the balances of all accounts at its end are
+    stored as snapshot. If lock is set, bookings within the year are refused
+    from now on, otherwise the period is (again) open for bookings.
+    Returns the period and the number of accounts in the snapshot.
+    """
+    with ClosedPeriod._meta.database.atomic():
+        period, _ = ClosedPeriod.get_or_create(
+            name=str(year),
+            defaults={"start_date": date(year, 1, 1), "end_date": date(year, 12, 31)},
+        )
+        period.locked = lock
+        period.save()
+        return period, period.take_snapshot()
+
+
 def get_account_saldo(account, start_date=None, end_date=None, with_virtual=False):
     """
     Sums all bookings for the given account in the given timeframe to return 1
     decimal (or two, if also the virtual bookings shall be considered).
 
-    If the selected account is parent to other accounts, the total of all child
-    accounts will be returned.
+    If the selected account is parent to other accounts, the bookings of all
+    accounts below it (at any depth) are included.
     """
     acc = Account.get(Account.name == account)
+    saldo, virtual_saldo = get_saldos([acc.id], start_date, end_date)[acc.id]
+    if with_virtual:
+        return (saldo, virtual_saldo)
+    else:
+        return saldo
 
-    child_saldo_stmt = (
-        Booking.select(fn.SUM(Booking.value))
-        .join(Account)
-        .switch(Booking)
-        .where(Account.parent == acc)
-    )
-    child_saldo = child_saldo_stmt.scalar()
 
-    if with_virtual:
-        child_virtual_saldo_stmt = (
-            VirtualBooking.select(fn.SUM(VirtualBooking.value))
-            .join(Account)
-            .switch(VirtualBooking)
-            .where(Account.parent == acc)
+def get_saldos(account_ids=None, start_date=None, end_date=None):
+    """
+    Returns a dict of the saldo and virtual saldo of the given accounts (of all
+    accounts, if none are given), each including the accounts below it.
+
+    The saldos are read from the AccountBalance, or, if a timeframe is given,
+    from the AccountMonthBalance of all whole months within it. Only the
+    bookings of the partial months at the beginning and the end of the
+    timeframe are summed up. Without a start date, the timeframe begins after
+    the last closed period, whose BalanceSnapshot is added.
+    """
+    start, end = as_date(start_date), as_date(end_date)
+    saldos = defaultdict(lambda: [Decimal("0.00"), Decimal("0.00")])
+
+    balances = []
+    partial_spans = []
+    if start is None and end is not None:
+        period = ClosedPeriod.latest(end)
+        if period is not None:
+            balances.append(
+                BalanceSnapshot.select(
+                    BalanceSnapshot.account,
+                    BalanceSnapshot.value,
+                    BalanceSnapshot.virtual_value,
+                ).where(
+                    (BalanceSnapshot.period == period)
+                    & in_accounts(BalanceSnapshot.account, account_ids)
+                )
+            )
+            start = period.end_date + timedelta(days=1)
+    if start is None and end is None:
+        balances.append(
+            AccountBalance.select(
+                AccountBalance.account,
+                AccountBalance.value,
+                AccountBalance.virtual_value,
+            ).where(in_accounts(AccountBalance.account, account_ids))
         )
-        child_virtual_saldo = child_virtual_saldo_stmt.scalar()
-        if child_saldo is not None:
-            if child_virtual_saldo is None:
-                child_virtual_saldo = 0.0
-            return (round(child_saldo, 2), round(child_virtual_saldo, 2))
-    else:
-        if child_saldo is not None:
-            return round(child_saldo, 2)
+    elif start is None or end is None or start <= end:
+        first_month, stop_month = whole_months(start, end)
+        if (start and end) and first_month >= stop_month:
+            # The timeframe is within one month
+            partial_spans.append((start, end))
+        else:
+            in_months = in_accounts(AccountMonthBalance.account, account_ids)
+            if first_month is not None:
+                in_months &= AccountMonthBalance.month >= first_month
+            if stop_month is not None:
+                in_months &= AccountMonthBalance.month < stop_month
+            balances.append(
+                AccountMonthBalance.select(
+                    AccountMonthBalance.account,
+                    fn.SUM(AccountMonthBalance.value),
+                    fn.SUM(AccountMonthBalance.virtual_value),
+                )
+                .where(in_months)
+                .group_by(AccountMonthBalance.account)
+            )
+            if start is not None and start < first_month:
+                partial_spans.append((start, first_month - timedelta(days=1)))
+            if end is not None and stop_month <= end:
+                partial_spans.append((stop_month, end))
+
+    for stmt in balances:
+        for acc_id, value, virtual_value in stmt.tuples():
+            saldos[acc_id][0] += to_decimal(value)
+            saldos[acc_id][1] += to_decimal(virtual_value)
+    for span_start, span_end in partial_spans:
+        for acc_id, value in sum_bookings(account_ids, span_start, span_end):
+            saldos[acc_id][0] += to_decimal(value)
+        for acc_id, value in sum_virtual_bookings(account_ids, span_start, span_end):
+            saldos[acc_id][1] += to_decimal(value)
+    if account_ids is not None:
+        return {acc_id: tuple(saldos[acc_id]) for acc_id in account_ids}
+    return {acc_id: tuple(saldo) for acc_id, saldo in saldos.items()}
 
-    stmt = (
-        Booking.select(fn.SUM(Booking.value))
-        .join(Account)
+
+def in_accounts(account_field, account_ids=None):
+    """
+    Returns the expression to filter account_field by the given account ids
+    (no filter if account_ids is None).
+    """
+    if account_ids is None:
+        return True
+    return account_field.in_(account_ids)
+
+
+def sum_bookings(account_ids, start=None, end=None):
+    """
+    Sums the bookings below each of the given accounts (all accounts, if
+    account_ids is None), between start and end.
+    """
+    return (
+        Booking.select(AccountClosure.ancestor, fn.SUM(Booking.value))
+        .join(AccountClosure, on=(AccountClosure.descendant == Booking.account))
         .switch(Booking)
         .join(JournalEntry)
-    )
-    if start_date and end_date:
-        stmt = stmt.where(
-            (Account.name == account)
-            & (JournalEntry.date >= start_date.datetime)
-            & (JournalEntry.date <= end_date.datetime)
+        .where(
+            in_accounts(AccountClosure.ancestor, account_ids)
+            & date_range(JournalEntry.date, start, end)
         )
-    else:
-        stmt = stmt.where(Account.name == account)
-    saldo = stmt.scalar()
-    if saldo is None:
-        saldo = Decimal("0.0")
-    else:
-        saldo = Decimal(saldo)
+        .group_by(AccountClosure.ancestor)
+        .tuples()
+    )
 
-    if with_virtual:
-        virtual_stmt = (
-            VirtualBooking.select(fn.SUM(VirtualBooking.value))
-            .join(Account)
-            .switch(VirtualBooking)
+
+def sum_virtual_bookings(account_ids, start=None, end=None):
+    """
+    Sums the virtual bookings below each of the given accounts (all accounts,
+    if account_ids is None), between start and end.
+    """
+    return (
+        VirtualBooking.select(AccountClosure.ancestor, fn.SUM(VirtualBooking.value))
+        .join(AccountClosure, on=(AccountClosure.descendant == VirtualBooking.account))
+        .where(
+            in_accounts(AccountClosure.ancestor, account_ids)
+            & date_range(VirtualBooking.date, start, end)
         )
-        if start_date and end_date:
-            virtual_stmt = virtual_stmt.where(
-                (Account.name == account)
-                & (VirtualBooking.date >= start_date.datetime)
-                & (VirtualBooking.date <= end_date.datetime)
-            )
-        else:
-            virtual_stmt = virtual_stmt.where((Account.name == account))
-        virtual_saldo = virtual_stmt.scalar()
-        if virtual_saldo is None:
-            virtual_saldo = Decimal("0.0")
-        else:
-            virtual_saldo = Decimal(virtual_saldo)
-        return (round(saldo, 2), round(virtual_saldo, 2))
-    else:
-        return round(saldo, 2)
+        .group_by(AccountClosure.ancestor)
+        .tuples()
+    )
+
+
+def whole_months(start=None, end=None):
+    """
+    Returns the first day of the first whole month on or after start and the
+    first day of the month after the last whole month until end.
+    """
+    first_month = stop_month = None
+    if start is not None:
+        first_month = start if start.day == 1 else next_month(start)
+    if end is not None:
+        stop_month = next_month(end)
+        if stop_month != end + timedelta(days=1):
+            stop_month = end.replace(day=1)
+    return first_month, stop_month
+
+
+def next_month(day):
+    """
+    Returns the first day of the month after the given day.
+    """
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
+
+
+def as_date(value):
+    """
+    Returns the date of the given arrow object (or None).
+    """
+    if value is None:
+        return None
+    return value.date()
+
+
+def date_range(date_field, start=None, end=None):
+    """
+    Returns the expression to filter date_field by start and/or end date.
+    """
+    expression = True
+    if start is not None:
+        expression &= date_field >= start
+    if end is not None:
+        expression &= date_field <= end
+    return expression
+
+
+def to_decimal(value):
+    """
+    Converts a sum returned by the database to a Decimal rounded to cents.
+    """
+    if value is None:
+        return Decimal("0.00")
+    return round(Decimal(str(value)), 2)
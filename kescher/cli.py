@@ -1,53 +1,96 @@
 #!/usr/bin/env python3
-import arrow
+"""
+The command line interface of kescher. As kescher is often called from
+scripts, e.g. thousands of times to book entries, the modules of kescher and
+their dependencies (peewee, arrow, pdfminer, yaml, ...) are only imported
+by the commands which use them.
+"""
 import click
+import json
 import logging
 import sys
 
-from colorama import init, Fore
 from decimal import Decimal
-from kescher.booking import (
-    auto_book_vat,
-    book_entry,
-    get_account_saldo,
-)
-from kescher.filters import (
-    BookingFilter,
-    JournalFilter,
-    UnbalancedFilter,
-    VirtualBookingFilter,
-)
-from kescher.importers import (
-    AccountImporter,
-    DocumentImporter,
-    InvoiceImporter,
-    JournalImporter,
-)
+from kescher.export import FORMATS
 from kescher.logging import setup_logging
-from kescher.models import Account, create_tables
-from kescher.show import show_accounts, show_table
 from pathlib import Path
-from peewee import DoesNotExist
 
 DEFAULT_WIDTH = 80
+DEFAULT_BATCH_SIZE = 100
+SHOW_FORMATS = ("table",) + FORMATS
+ACCOUNT_COLUMNS = ("layer", "name", "saldo", "virtual_saldo")
+EXPORT_FILTERS = {
+    "journal": "JournalFilter",
+    "bookings": "BookingFilter",
+    "virtualbookings": "VirtualBookingFilter",
+    "unbalanced": "UnbalancedFilter",
+}
+
+
+def main():
+    """
+    Entry point of the kescher script, resets the colors after each print.
+    """
+    from colorama import init
 
-cwd = Path.cwd()
-logger = setup_logging(cwd)
-init(autoreset=True)
+    init(autoreset=True)
+    cli()
+
+
+def parse_date(ctx, param, value):
+    """
+    Returns the arrow object of a date option (or None).
+    """
+    if value is None:
+        return None
+    import arrow
+
+    return arrow.get(value)
+
+
+def collect_stats(ctx, show_stats, stats_file):
+    """
+    Collects the SQL statements and stages of the command and reports them,
+    when it is done.
+    """
+    from kescher import stats
+
+    collected = ctx.with_resource(stats.collect())
+
+    def report():
+        summary = collected.summary()
+        if show_stats:
+            for line in stats.format_summary(summary):
+                click.echo(line, err=True)
+        if stats_file:
+            with open(stats_file, "w") as out:
+                json.dump(summary, out, indent=2)
+
+    ctx.call_on_close(report)
 
 
 @click.group()
 @click.option(
     "--debug/--no-debug", default=False, help="Activate/Deactive verbose logging."
 )
-def cli(debug):
+@click.option(
+    "--stats", "show_stats", is_flag=True, default=False, help="Print SQL timings."
+)
+@click.option(
+    "--stats-file", type=click.Path(dir_okay=False), help="Write timings as JSON."
+)
+@click.pass_context
+def cli(ctx, debug, show_stats, stats_file):
     """
     kescher cli allows you to bulk import invoices, journals, accounts and documents. Furthermore
     you can use various reporting functions to get a quick overview over your accounts.
     """
+    logger = setup_logging(Path.cwd())
     if debug:
         logger.setLevel(logging.DEBUG)
     logger.debug("Debug mode is on")
+    if show_stats or stats_file:
+        collect_stats(ctx, show_stats, stats_file)
 
 
 @cli.group("import")
@@ -59,47 +102,131 @@ def importer():
 
 
 @importer.command("journal")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=0),
+    default=DEFAULT_BATCH_SIZE,
+    help="Rows per bulk insert, 0 imports row by row.",
+)
 @click.argument("journal_file", type=click.File("r"))
-def import_journal(journal_file):
+def import_journal(batch_size, journal_file):
     """
     Import journal entries from csv.
     """
+    from kescher.importers import JournalImporter
+
     print(f"Importing CSV journal {journal_file.name}...")
-    JournalImporter(journal_file)()
+    journal_importer = JournalImporter(journal_file, batch_size=batch_size)
+    journal_importer()
+    print(
+        f"{journal_importer.n_new} new entries, "
+        + f"{journal_importer.n_duplicates} duplicates skipped."
+    )
+
+
+@importer.command("bank")
+@click.option("--bank", default=None, help="e.g. postbank, detected by the header.")
+@click.option("--reverse", is_flag=True, default=False, help="Last row first?")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BATCH_SIZE,
+    help="Rows per bulk insert.",
+)
+@click.argument("bank_file", type=click.Path(exists=True, dir_okay=False))
+def import_bank(bank, reverse, batch_size, bank_file):
+    """
+    Import journal entries straight from the csv export of a bank.
+    """
+    from kescher.importers import BankImporter
+    from kescher.parsers import BANK_PARSERS, CsvHeaderError, detect_parser
+
+    try:
+        parser = BANK_PARSERS[bank]() if bank else detect_parser(bank_file)
+    except KeyError:
+        sys.exit(f"Unknown bank {bank}, known are: {', '.join(BANK_PARSERS)}.")
+    except CsvHeaderError as e:
+        sys.exit(e)
+    print(f"Importing {parser.name} export {bank_file}...")
+    with open(bank_file, encoding=parser.encoding, newline="") as bank_csv:
+        bank_importer = BankImporter(bank_csv, parser, reverse, batch_size)
+        bank_importer()
+    print(
+        f"{bank_importer.n_new} new entries, "
+        + f"{bank_importer.n_duplicates} duplicates skipped."
+    )
 
 
 @importer.command("accounts")
 @click.argument("account_file", type=click.File("r"))
 def import_accounts(account_file):
     """
-    Bulk import accounts from yaml file.
+    Bulk import accounts from yaml file. Accounts which exist already are
+    kept, thus an amended file can be imported again.
     """
+    from kescher.importers import AccountImporter
+
     print(f"Importing accounts from file {account_file.name}...")
-    AccountImporter(account_file)()
+    account_importer = AccountImporter(account_file)
+    account_importer()
+    print(
+        f"{account_importer.n_added} accounts added, "
+        + f"{account_importer.n_unchanged} unchanged, "
+        + f"{len(account_importer.orphaned)} orphaned."
+    )
+    if account_importer.orphaned:
+        print(f"Orphaned accounts: {', '.join(account_importer.orphaned)}")
 
 
 @importer.command("documents")
+@click.option(
+    "--jobs", "-j", type=click.IntRange(min=1), default=1, help="Parallel processes."
+)
+@click.option("--verify", is_flag=True, default=False, help="Re-hash unchanged files.")
 @click.argument("path", type=click.Path(exists=True))
-def import_documents(path):
+def import_documents(jobs, verify, path):
     """
     Bulk import pdf documents.
     """
+    from kescher.importers import DocumentImporter
+
     print(f"Importing documents from {path}...")
-    DocumentImporter(path)()
+    document_importer = DocumentImporter(path, jobs=jobs, verify=verify)
+    document_importer()
+    print(
+        f"{document_importer.n_new_documents} new documents, "
+        + f"{document_importer.n_extracted_documents} extracted, "
+        + f"{document_importer.n_unchanged_documents} unchanged."
+    )
 
 
 @importer.command("invoices")
 @click.option("--flat/--nested", default=False, help="Invoices in subdirectories?")
+@click.option(
+    "--jobs", "-j", type=click.IntRange(min=1), default=1, help="Parallel processes."
+)
+@click.option("--verify", is_flag=True, default=False, help="Re-hash unchanged files.")
 @click.argument("path", type=click.Path(exists=True))
 @click.argument("account_key")
 @click.argument("amount_key")
 @click.argument("date_key")
-def import_invoices(flat, path, account_key, amount_key, date_key):
+def import_invoices(flat, jobs, verify, path, account_key, amount_key, date_key):
     """
     Bulk import yaml invoices.
     """
+    from kescher.importers import InvoiceImporter
+
     print(f"Import invoices from {path}...")
-    InvoiceImporter(path, account_key, amount_key, date_key, flat)()
+    invoice_importer = InvoiceImporter(
+        path, account_key, amount_key, date_key, flat, jobs, verify
+    )
+    invoice_importer()
+    print(
+        f"{invoice_importer.n_new} new invoices, "
+        + f"{invoice_importer.n_duplicates} duplicates skipped."
+    )
+    if invoice_importer.n_locked:
+        print(f"Skipped {invoice_importer.n_locked} invoices in locked periods.")
 
 
 @cli.group()
@@ -111,16 +238,37 @@ def book():
 
 
 @book.command()
+@click.option("--start", default=None, callback=parse_date)
+@click.option("--end", default=None, callback=parse_date)
+@click.option("--dry-run", is_flag=True, default=False, help="Only report, don't book.")
 @click.argument("vat_percentage", type=click.INT)
 @click.argument("vat_in_acc")
 @click.argument("vat_out_acc")
-def vat(vat_percentage, vat_in_acc, vat_out_acc):
+def vat(start, end, dry_run, vat_percentage, vat_in_acc, vat_out_acc):
     """
     Helper to bulk book vat.
 
     You have to give your default VAT percentage as well as the names of your VAT accounts.
+    Journal entries which already have a booking to one of these accounts are skipped,
+    as are entries in locked periods.
     """
-    auto_book_vat(vat_percentage, vat_in_acc, vat_out_acc)
+    from kescher.booking import auto_book_vat
+    from peewee import IntegrityError
+
+    try:
+        summary = auto_book_vat(
+            vat_percentage, vat_in_acc, vat_out_acc, start, end, dry_run
+        )
+    except IntegrityError as e:
+        sys.exit(e)
+    action = "Would book" if dry_run else "Booked"
+    print(f"VAT already booked for {summary.n_already_booked} entries.")
+    if summary.n_locked:
+        print(f"Skipped {summary.n_locked} entries in locked periods.")
+    print(f"{action} {summary.n_in} entries with {summary.total_in} to {vat_in_acc}.")
+    print(
+        f"{action} {summary.n_out} entries with {summary.total_out} to {vat_out_acc}."
+    )
 
 
 @book.command("entry")
@@ -134,9 +282,15 @@ def entry(value, comment, force, width, journalentry, account):
     """
     Book the absolute value of the non-booked rest of a journalentry to the given account.
     """
+    from colorama import Fore
+    from kescher.booking import book_entry
+    from kescher.filters import BookingFilter, JournalFilter
+    from kescher.show import show_table
+    from peewee import IntegrityError
+
     try:
         book_entry(value, comment, journalentry, account, force)
-    except ValueError as e:
+    except (ValueError, IntegrityError) as e:
         sys.exit(e)
     print(Fore.YELLOW + "Entry")
     show_table(JournalFilter(), f"id={journalentry}", width)
@@ -156,6 +310,12 @@ def show():
 @click.argument("account")
 @click.option("--width", type=click.INT, default=DEFAULT_WIDTH)
 def show_account(account, width):
+    from colorama import Fore
+    from kescher.booking import get_account_saldo
+    from kescher.filters import BookingFilter, VirtualBookingFilter
+    from kescher.models import Account
+    from kescher.show import show_table
+
     acc = Account.get(Account.name == account)
     print(Fore.YELLOW + "Bookings")
     show_table(BookingFilter(), f"account_id={acc.id}", width)
@@ -169,46 +329,87 @@ def show_account(account, width):
 
 @show.command()
 @click.argument("account")
-@click.option("--start", default=None)
-@click.option("--end", default=None)
+@click.option("--start", default=None, callback=parse_date)
+@click.option("--end", default=None, callback=parse_date)
 @click.option("--with-virtual", default=False)
 def saldo(account, start, end, with_virtual):
     """
     Sum account bookings for given time frame.
     """
-    if start is not None:
-        start = arrow.get(start)
-    if end is not None:
-        end = arrow.get(end)
+    from kescher.booking import get_account_saldo
+
     saldo = get_account_saldo(account, start, end, with_virtual)
     print(f"Saldo is {saldo}")
 
 
 @show.command()
-@click.option("--filter", default=None)
+@click.option("--filter", default=None, help="e.g. 'date=2020-02-01.. AND value<0'")
+@click.option("--limit", type=click.IntRange(min=1), default=None)
+@click.option("--after-id", type=click.INT, default=None, help="Entries after id.")
+@click.option("--before-id", type=click.INT, default=None, help="Entries before id.")
+@click.option("--order", type=click.Choice(["asc", "desc"]), default="asc")
+@click.option("--format", "format_", type=click.Choice(SHOW_FORMATS), default="table")
 @click.option("--width", type=click.INT, default=DEFAULT_WIDTH)
-def journal(filter, width):
+def journal(filter, limit, after_id, before_id, order, format_, width):
     """
-    Show all journal entries or filter by value.
+    Show all journal entries or filter them.
+
+    The filter consists of conditions joined by AND (upper case). Conditions
+    compare a column with =, !=, <, >, <= or >=, match a range
+    (date=2020-01-01..2020-01-31), a list (id IN 1,2,3) or a substring
+    (subject~strom).
     """
-    show_table(JournalFilter(), filter, width)
+    from kescher.filters import JournalFilter
+    from kescher.show import show_table
+
+    journal_filter = JournalFilter(limit, after_id, before_id, order)
+    if format_ == "table":
+        show_table(journal_filter, filter, width)
+    else:
+        export_table(journal_filter, filter, sys.stdout, format_)
 
 
 @show.command()
+@click.option("--format", "format_", type=click.Choice(SHOW_FORMATS), default="table")
 @click.option("--width", type=click.INT, default=DEFAULT_WIDTH)
-def unbalanced(width):
-    """
-    Show journal entries where added bookings do not add up to zero.
-    """
-    show_table(UnbalancedFilter(), None, width)
+def unbalanced(format_, width):
+    """
+    Show journal entries which are not booked completely, with the number of
+    entries and the amount left to book (or booked too much) per status.
+    """
+    from kescher.booking import get_unbalanced_summary
+    from kescher.filters import UnbalancedFilter
+    from kescher.show import show_table
+
+    if format_ == "table":
+        show_table(UnbalancedFilter(), None, width)
+        for status, (count, total) in get_unbalanced_summary().items():
+            if status == "overbooked":
+                print(f"{status}: {count} entries, {total} booked too much.")
+            else:
+                print(f"{status}: {count} entries, {total} left to book.")
+    else:
+        export_table(UnbalancedFilter(), None, sys.stdout, format_)
 
 
 @show.command()
-def accounts():
-    """
-    List all known accounts
-    """
-    for layer, name, saldo, virtual_saldo in show_accounts():
+@click.option("--depth", type=click.IntRange(min=0), default=None)
+@click.option("--start", default=None, callback=parse_date)
+@click.option("--end", default=None, callback=parse_date)
+@click.option("--format", "format_", type=click.Choice(SHOW_FORMATS), default="table")
+def accounts(depth, start, end, format_):
+    """
+    List all known accounts (down to the given depth) and their saldo.
+    """
+    from colorama import Fore
+    from kescher.export import write_rows
+    from kescher.show import show_accounts
+
+    if format_ != "table":
+        rows = show_accounts(depth, start, end)
+        write_rows(ACCOUNT_COLUMNS, rows, sys.stdout, format_)
+        return
+    for layer, name, saldo, virtual_saldo in show_accounts(depth, start, end):
         if not virtual_saldo:
             real_saldo = saldo
         else:
@@ -227,19 +428,135 @@ def show_entry(width, entry_id):
     """
     Show a journal entry and all corresponding bookings.
     """
+    from colorama import Fore
+    from kescher.filters import BookingFilter, JournalFilter
+    from kescher.show import show_table
+
     print(Fore.YELLOW + "Entry")
     show_table(JournalFilter(), f"id={entry_id}", width)
     print(Fore.YELLOW + "Bookings")
     show_table(BookingFilter(), f"journalentry_id={entry_id}", width)
 
 
+@cli.command()
+@click.option("--journal/--no-journal", default=True, help="Search journal entries?")
+@click.option("--documents/--no-documents", default=True, help="Search documents?")
+@click.option("--page", type=click.IntRange(min=1), default=1)
+@click.option("--per-page", type=click.IntRange(min=1), default=20)
+@click.option("--width", type=click.INT, default=DEFAULT_WIDTH)
+@click.argument("query")
+def search(journal, documents, page, per_page, width, query):
+    """
+    Full-text search of journal entries (sender, receiver, subject) and documents.
+    The query uses the SQLite FTS5 syntax, e.g. 'strom OR internet' or 'rechn*'.
+    """
+    from colorama import Fore
+    from kescher.filters import DocumentSearchFilter, JournalSearchFilter
+    from kescher.show import show_table
+
+    if journal:
+        print(Fore.YELLOW + "Journal")
+        show_table(JournalSearchFilter(page, per_page), query, width)
+    if documents:
+        print(Fore.YELLOW + "Documents")
+        show_table(DocumentSearchFilter(page, per_page), query, width)
+
+
+@cli.command("export")
+@click.option("--filter", default=None, help="Filter as for show journal.")
+@click.option("--format", "format_", type=click.Choice(FORMATS), default="csv")
+@click.option("--output", "-o", type=click.File("w"), default="-")
+@click.argument("table", type=click.Choice(list(EXPORT_FILTERS) + ["accounts"]))
+def export(filter, format_, output, table):
+    """
+    Export a table with all columns as CSV, NDJSON or JSON.
+    """
+    from kescher import filters
+    from kescher.export import write_rows
+    from kescher.show import show_accounts
+
+    if table == "accounts":
+        write_rows(ACCOUNT_COLUMNS, show_accounts(), output, format_)
+    else:
+        filter_fct = getattr(filters, EXPORT_FILTERS[table])()
+        export_table(filter_fct, filter, output, format_)
+
+
+def export_table(filter_fct, filter_, out, format_):
+    """
+    Write the rows of a filter to out in the given format.
+    """
+    from kescher.export import write_rows
+
+    try:
+        columns, rows = filter_fct.export(filter_)
+    except ValueError as e:
+        sys.exit(e)
+    write_rows(columns, rows, out, format_)
+
+
 @cli.command("init")
 def initialize():
     """
     Create the database in the current working directory.
     """
+    from kescher.database import get_db
+    from kescher.migrations import migrate_database
+    from kescher.models import create_tables
+
     print("Setting up database and directories...")
+    migrate_database(get_db())
+    create_tables()
+
+
+@cli.command()
+def migrate():
+    """
+    Bring a database of an earlier version of kescher up to date.
+    """
+    from kescher.database import get_db
+    from kescher.migrations import database_size, migrate_database
+    from kescher.models import create_tables
+
+    size_before = database_size(get_db())
+    applied = migrate_database(get_db())
     create_tables()
+    for name in applied:
+        print(f"Applied migration {name}.")
+    if "migrate_document_content" in applied:
+        # Measured after create_tables has built the full-text indexes again
+        get_db().execute_sql("VACUUM")
+        saved = size_before - database_size(get_db())
+        n_documents = applied["migrate_document_content"]
+        print(f"Migrated content of {n_documents} documents, saved {saved} bytes.")
+    print(f"Database is at version {get_db().user_version}.")
+
+
+@cli.command()
+@click.option("--lock/--no-lock", default=False, help="Refuse bookings in the year?")
+@click.argument("year", type=click.INT)
+def close(lock, year):
+    """
+    Close a fiscal year: snapshot the balances of all accounts at its end.
+    Saldos without start date only sum up the bookings after the snapshot.
+    """
+    from kescher.booking import close_period
+
+    period, n_accounts = close_period(year, lock)
+    print(f"Closed {period.name} with balances of {n_accounts} accounts.")
+    if period.locked:
+        print(f"Bookings in {period.name} are locked.")
+
+
+@cli.command("rebuild-balances")
+def rebuild_balances():
+    """
+    Recompute the account balances from all bookings.
+    """
+    from kescher.models import AccountBalance
+
+    n_inconsistent = AccountBalance.rebuild()
+    print(f"Rebuilt balances, {n_inconsistent} accounts were inconsistent.")
 
 
 @cli.group()
@@ -254,6 +571,9 @@ def create():
 @click.option("--parent", default=None)
 @click.argument("name")
 def create_account(parent, name):
+    from kescher.models import Account
+    from peewee import DoesNotExist
+
     parent_account = None
     if parent:
         try:
@@ -268,3 +588,7 @@ def create_account(parent, name):
         print(f"New account created: {new_acc[0]}")
     else:
         print(f"Account already exists: {new_acc[0]}")
+
+
+if __name__ == "__main__":
+    main()
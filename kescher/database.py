@@ -1,7 +1,82 @@
+import configparser
+import os
+import time
+import zlib
+
+from kescher import stats
 from peewee import SqliteDatabase
 
 KESCHER_DB_NAME = "kescher.db"
+KESCHER_CONFIG_NAME = "kescher.cfg"
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+    "busy_timeout": 5000,
+}
+
+_database = None
+
+
+def decompress(value):
+    """
+    Decompresses a text stored by CompressedTextField, in SQL.
+    """
+    if value is None:
+        return None
+    return zlib.decompress(value).decode()
+
+
+class KescherDatabase(SqliteDatabase):
+    """
+    Reports every statement with its duration to kescher.stats, while
+    statistics are collected. The compressed texts of the documents can be
+    read in SQL with decompress(), which the full-text index relies on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.register_function(decompress, "decompress", 1)
+
+    def execute_sql(self, sql, *args, **kwargs):
+        collected = stats.get_stats()
+        if collected is None:
+            return super().execute_sql(sql, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            collected.add_statement(sql, time.perf_counter() - start)
 
 
 def get_db():
-    return SqliteDatabase(KESCHER_DB_NAME)
+    """
+    Returns the database of the current working directory. The database is
+    created once per process, s.t. all models and importers share the same
+    connection and transactions.
+    """
+    global _database
+    if _database is None:
+        _database = KescherDatabase(KESCHER_DB_NAME, pragmas=get_pragmas())
+    return _database
+
+
+def get_pragmas(config_file=KESCHER_CONFIG_NAME, environ=os.environ):
+    """
+    Returns the pragmas for the database connection: the defaults, updated by
+    the [database] section of the config file and then by the environment
+    variables KESCHER_<PRAGMA>, e.g. KESCHER_SYNCHRONOUS=full.
+    """
+    pragmas = dict(DEFAULT_PRAGMAS)
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    if config.has_section("database"):
+        pragmas.update(config["database"])
+    for pragma in DEFAULT_PRAGMAS:
+        value = environ.get(f"KESCHER_{pragma.upper()}")
+        if value is not None:
+            pragmas[pragma] = value
+    return pragmas
@@ -0,0 +1,60 @@
+"""
+Exports write rows as CSV, newline-delimited JSON (one object per line) or
+as one JSON array. The rows are plain tuples streamed from a database
+cursor, s.t. the memory used does not grow with the number of rows. Values
+are not truncated, amounts are rounded to cents as in the tables and
+written as strings to keep them exact.
+"""
+import csv
+import json
+
+from decimal import Decimal
+
+FORMATS = ("csv", "ndjson", "json")
+
+
+def write_rows(columns, rows, out, format_):
+    """
+    Writes the rows (tuples of the values of the columns) to the file-like
+    out in the given format.
+    """
+    if format_ not in FORMATS:
+        raise ValueError(f"Unknown export format {format_}")
+    WRITERS[format_](columns, map(round_amounts, rows), out)
+
+
+def round_amounts(row):
+    return tuple(round(v, 2) if isinstance(v, Decimal) else v for v in row)
+
+
+def write_csv(columns, rows, out):
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+def write_ndjson(columns, rows, out):
+    for row in rows:
+        out.write(to_json(columns, row))
+        out.write("\n")
+
+
+def write_json(columns, rows, out):
+    out.write("[")
+    separator = "\n"
+    for row in rows:
+        out.write(separator)
+        out.write(to_json(columns, row))
+        separator = ",\n"
+    out.write("\n]\n")
+
+
+def to_json(columns, row):
+    """
+    Returns the row as JSON object. Decimals and dates are written as
+    strings.
+    """
+    return json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False)
+
+
+WRITERS = {"csv": write_csv, "ndjson": write_ndjson, "json": write_json}
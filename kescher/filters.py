@@ -1,45 +1,194 @@
-from decimal import Decimal
-from kescher.models import Booking, JournalEntry, VirtualBooking
-from peewee import fn
+import operator
+import re
+
+from datetime import date
+from functools import reduce
+from decimal import Decimal, InvalidOperation
+from kescher.models import (
+    Booking,
+    Document,
+    DocumentContent,
+    DocumentIndex,
+    JournalEntry,
+    JournalEntryIndex,
+    UNBALANCED_STATUSES,
+    VirtualBooking,
+)
+from peewee import (
+    DateField,
+    DecimalField,
+    Field,
+    ForeignKeyField,
+    IntegerField,
+    NodeList,
+    OperationalError,
+    SQL,
+    Value,
+    fn,
+)
 
 MIN_WIDTH = 61
 
+# Only the upper case AND joins conditions, s.t. values may contain "and"
+AND_SPLIT = re.compile(r"\s+AND\s+")
+# The wildcards of LIKE and its escape character, matched literally by ~
+LIKE_SPECIAL = re.compile(r"[\\%_]")
+CONDITION = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>|~)\s*(.*?)\s*$")
+IN_CONDITION = re.compile(r"^\s*(\w+)\s+(IN)\s+(.+?)\s*$", re.IGNORECASE)
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+
+
+def format_line(item, columns):
+    """
+    Returns the columns of the item (model instance) as list of strings,
+    truncated and justified to the column widths.
+    """
+    line = []
+    for col, length, just, name in columns:
+        value = getattr(item, col)
+        if isinstance(value, Decimal):
+            value = round(value, 2)
+        element = str(value)[:length]
+        just_method = getattr(element, just)
+        line.append(just_method(length))
+    return line
+
+
+def parse_filter(model, filter_):
+    """
+    Compiles the filter to a (parameterized) expression on the columns of
+    the model. The filter consists of conditions joined by AND, e.g.
+    "date=2020-01-01..2020-01-31 AND value<0 AND subject~strom". Supported are
+    the comparisons = != < > <= >=, ranges a..b (either end may be omitted),
+    "column IN a,b,c" and substring matching with ~. Conditions are joined by
+    the upper case AND only.
+    """
+    expressions = []
+    for condition in AND_SPLIT.split(filter_.strip()):
+        match = CONDITION.match(condition) or IN_CONDITION.match(condition)
+        if not match:
+            raise ValueError(f"Invalid filter condition '{condition}'")
+        column, op, value = match.groups()
+        field = getattr(model, column, None)
+        if not isinstance(field, Field):
+            raise ValueError(f"{column} is not a filterable column")
+
+        if op.upper() == "IN":
+            values = [convert(field, v.strip()) for v in value.split(",")]
+            expressions.append(field.in_(values))
+        elif op == "~":
+            expressions.append(contains(field, value))
+        elif op == "=" and ".." in value:
+            start, end = value.split("..", 1)
+            if not (start or end):
+                raise ValueError(f"Invalid filter condition '{condition}'")
+            if start:
+                expressions.append(field >= convert(field, start))
+            if end:
+                expressions.append(field <= convert(field, end))
+        else:
+            expressions.append(OPERATORS[op](field, convert(field, value)))
+    return reduce(operator.and_, expressions)
+
+
+def contains(field, value):
+    """
+    Matches the fields containing value, case-insensitively as LIKE does.
+    The wildcards % and _ in value are matched literally.
+    """
+    pattern = "%" + LIKE_SPECIAL.sub(r"\\\g<0>", value) + "%"
+    return NodeList((field, SQL("LIKE"), Value(pattern), SQL("ESCAPE '\\'")))
+
+
+def convert(field, value):
+    """
+    Converts the value of a filter condition to the type of the field.
+    """
+    try:
+        if isinstance(field, (ForeignKeyField, IntegerField)):
+            return int(value)
+        if isinstance(field, DecimalField):
+            return Decimal(value)
+        if isinstance(field, DateField):
+            return date.fromisoformat(value)
+    except (ValueError, InvalidOperation):
+        raise ValueError(f"Invalid value '{value}' for column {field.name}")
+    return value
+
 
 class ModelFilter:
+    """
+    Base class of the table filters. The rows may be paginated by their id
+    (keyset pagination): at most limit rows with an id after after_id and/or
+    before before_id are shown, ordered by id. As the rows are searched via
+    the primary key, any page is found in constant time.
+    """
 
     columns = None
     model = None
 
-    def __call__(self, filter_, width, header=True):
-        column = None
-        if filter_:
-            filter_split = filter_.split("=")
-            if len(filter_split) != 2:
-                raise ValueError("Filter must contain exactly one '='")
-            column, filter_string = filter_split
-            if not hasattr(self.model, column):
-                raise ValueError(f"{column} is not a filterable column")
-
-        if column:
-            selector = self.model.select().where(
-                getattr(self.model, column) == filter_string
-            )
-        else:
-            selector = self.model.select()
+    def __init__(self, limit=None, after_id=None, before_id=None, order="asc"):
+        self.limit = limit
+        self.after_id = after_id
+        self.before_id = before_id
+        self.descending = order == "desc"
 
+    def __call__(self, filter_, width, header=True):
+        selector = self.select(filter_)
         if header:
             yield [c[3].ljust(c[1]) for c in self.columns]
 
         for je in selector:
-            line = []
-            for col, length, just, name in self.columns:
-                value = getattr(je, col)
-                if isinstance(value, Decimal):
-                    value = round(value, 2)
-                element = str(value)[:length]
-                just_method = getattr(element, just)
-                line.append(just_method(length))
-            yield line
+            yield format_line(je, self.columns)
+
+    def export(self, filter_):
+        """
+        Returns the names of all columns of the model and an iterator over
+        the matching rows as plain tuples.
+        """
+        fields = self.model._meta.sorted_fields
+        return [f.column_name for f in fields], self.select(filter_, *fields)
+
+    def select(self, filter_, *fields):
+        """
+        Returns an iterator over the rows matching the filter, paginated and
+        ordered. If fields are given, the rows are tuples of these fields,
+        otherwise model instances.
+        """
+        expressions = []
+        if filter_:
+            expressions.append(parse_filter(self.model, filter_))
+        if self.after_id is not None:
+            expressions.append(self.model.id > self.after_id)
+        if self.before_id is not None:
+            expressions.append(self.model.id < self.before_id)
+
+        # With a limit, the rows next to the given id are the ones to show
+        fetch_descending = self.descending
+        if self.limit is not None:
+            if self.after_id is not None and self.before_id is None:
+                fetch_descending = False
+            elif self.before_id is not None and self.after_id is None:
+                fetch_descending = True
+        selector = (
+            self.model.select(*fields)
+            .order_by(self.model.id.desc() if fetch_descending else self.model.id)
+            .limit(self.limit)
+        )
+        if expressions:
+            selector = selector.where(*expressions)
+        if fields:
+            selector = selector.tuples()
+        if fetch_descending != self.descending:
+            return reversed(list(selector))
+        return selector.iterator()
 
 
 class JournalFilter(ModelFilter):
@@ -97,6 +246,10 @@ class VirtualBookingFilter(ModelFilter):
 
 
 class UnbalancedFilter:
+    """
+    Journal entries whose bookings do not add up to their value: unbooked,
+    partially booked and overbooked entries, looked up via the status index.
+    """
 
     columns = (
         ["id", 3, "zfill", "ID"],
@@ -104,46 +257,129 @@ class UnbalancedFilter:
         ["receiver", 15, "ljust", "Receiver"],
         ["subject", 36, "ljust", "Subject"],
         ["value", 9, "rjust", "Value"],
-        ["bookings", 9, "rjust", "Bookings"],
+        ["booked", 9, "rjust", "Booked"],
+        ["status", 10, "ljust", "Status"],
     )
 
     def __call__(self, filter_, width, header=True):
         if width <= MIN_WIDTH:
             width = MIN_WIDTH
-        self.columns[3][1] = width - 54
+        self.columns[3][1] = width - 65
 
         if header:
             yield [c[3].ljust(c[1]) for c in self.columns]
-        selector = (
+
+        for je in self.select(filter_):
+            yield format_line(je, self.columns)
+
+    def export(self, filter_):
+        """
+        Returns the names of the columns and an iterator over the unbalanced
+        entries as plain tuples.
+        """
+        return [c[0] for c in self.columns], self.select(filter_).tuples().iterator()
+
+    def select(self, filter_=None):
+        """
+        Returns the query of the unbalanced entries, narrowed by the filter
+        on the columns of the journal entries, if one is given.
+        """
+        query = (
             JournalEntry.select(
                 JournalEntry.id,
                 JournalEntry.sender,
                 JournalEntry.receiver,
                 JournalEntry.subject,
                 JournalEntry.value,
-                fn.SUM(Booking.value).alias("bookings"),
+                JournalEntry.booked,
+                JournalEntry.status,
             )
-            .join(Booking)
-            .group_by(JournalEntry)
-            .having(fn.SUM(Booking.value) > 0)
+            .where(JournalEntry.status.in_(UNBALANCED_STATUSES))
+            .order_by(JournalEntry.id)
         )
+        if filter_:
+            query = query.where(parse_filter(JournalEntry, filter_))
+        return query
 
-        for je in selector:
-            line = []
-            for col, length, just, name in self.columns:
-                value = getattr(je, col)
-                if isinstance(value, Decimal):
-                    value = round(value, 2)
-                element = str(value)[:length]
-                just_method = getattr(element, just)
-                line.append(just_method(length))
-            yield line
-
-
-# SELECT journalentry.id, SUM(booking.value) as saldo FROM journalentry
-#        LEFT JOIN booking
-#        ON journalentry.id = booking.journalentry_id
-#        GROUP BY journalentry.id
-#        HAVING SUM(booking.value) > 0
-#        ORDER BY SUM(booking.value) DESC;
-#
+
+class SearchFilter:
+    """
+    Base class of the full-text searches. The filter is the search query in
+    SQLite FTS5 syntax, the results are ranked and paginated.
+    """
+
+    columns = None
+
+    def __init__(self, page=1, per_page=20):
+        self.page = page
+        self.per_page = per_page
+
+    def __call__(self, filter_, width, header=True):
+        if width <= MIN_WIDTH:
+            width = MIN_WIDTH
+        self.query = filter_
+        # The last column takes the remaining width, borders included
+        self.columns[-1][1] = (
+            width - sum(c[1] for c in self.columns[:-1]) - len(self.columns) - 1
+        )
+        if header:
+            yield [c[3].ljust(c[1]) for c in self.columns]
+        selector = (
+            self.select().limit(self.per_page).offset((self.page - 1) * self.per_page)
+        )
+        try:
+            for item in selector:
+                yield format_line(item, self.columns)
+        except OperationalError as e:
+            raise ValueError(f"Invalid search query {filter_}: {e}")
+
+
+class JournalSearchFilter(SearchFilter):
+
+    columns = (
+        ["id", 3, "zfill", "ID"],
+        ["date", 10, "ljust", "Date"],
+        ["sender", 15, "ljust", "Sender"],
+        ["receiver", 15, "ljust", "Receiver"],
+        ["value", 9, "rjust", "Value"],
+        ["subject", 28, "ljust", "Subject"],
+    )
+
+    def select(self):
+        return (
+            JournalEntry.select(
+                JournalEntry.id,
+                JournalEntry.date,
+                JournalEntry.sender,
+                JournalEntry.receiver,
+                JournalEntry.value,
+                JournalEntry.subject,
+            )
+            .join(JournalEntryIndex, on=(JournalEntryIndex.rowid == JournalEntry.id))
+            .where(JournalEntryIndex.match(self.query))
+            .order_by(JournalEntryIndex.rank())
+        )
+
+
+class DocumentSearchFilter(SearchFilter):
+
+    columns = (
+        ["id", 3, "zfill", "ID"],
+        ["snippet", 30, "ljust", "Match"],
+        ["path", 43, "ljust", "Path"],
+    )
+
+    def select(self):
+        return (
+            Document.select(
+                Document.id,
+                fn.replace(
+                    fn.snippet(DocumentIndex._meta.entity, 0, "", "", "…", 6), "\n", " "
+                ).alias("snippet"),
+                Document.path,
+            )
+            .join(DocumentContent, on=(DocumentContent.hash == Document.hash))
+            .join(DocumentIndex, on=(DocumentIndex.rowid == DocumentContent.id))
+            .where(DocumentIndex.match(self.query))
+            .order_by(DocumentIndex.rank(), Document.path)
+        )
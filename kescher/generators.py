@@ -0,0 +1,192 @@
+"""
+Generators create synthetic, but realistic ledgers of any size: bank
+statements in the sanitized CSV format, account trees, invoices with their
+documents and bookings. They are deterministic, i.e. the same seed yields
+the same ledger, s.t. benchmarks can be compared between versions.
+"""
+import random
+import yaml
+
+from datetime import date, timedelta
+from decimal import Decimal
+from kescher.database import get_db
+from kescher.models import Booking, JournalEntry
+from pathlib import Path
+
+OWN_NAME = "kescher e.V."
+VAT_ACCOUNTS = ("USt_Einnahmen", "USt_Ausgaben")
+
+FIRST_NAMES = ("Klausi", "Susanne", "Ayten", "Jonas", "Mia", "Emre", "Lea", "Paul")
+LAST_NAMES = ("Meyer", "Wilmer", "Uzun", "Schmidt", "Novak", "Yilmaz", "Kraus")
+SUPPLIERS = ("Haus AG", "Stromomat GmbH", "Halmann KG", "Kabel & Co", "Telefonia")
+INCOME_SUBJECTS = ("Internet Betrag", "Mitgliedsbeitrag", "Spende")
+EXPENSE_SUBJECTS = ("Miete", "Strom", "Telefon", "Hardware", "Verbrauchsmaterial")
+
+
+def generate_journal(path, n_rows, seed=0, start_date=date(2019, 1, 1)):
+    """
+    Writes a bank statement of n_rows rows in the sanitized CSV format
+    (D.M.YYYY;sender;receiver;subject;value;balance) to path. About two in
+    three rows are incoming payments, there are about 50 rows per day.
+    """
+    rng = random.Random(seed)
+    balance = Decimal("10000.00")
+    day = start_date
+    with open(path, "w") as journal_file:
+        for n in range(n_rows):
+            if rng.random() < 0.02:
+                day += timedelta(days=1)
+            if rng.random() < 0.66:
+                sender = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+                receiver = OWN_NAME
+                subject = f"{rng.choice(INCOME_SUBJECTS)} {n}"
+                value = Decimal(rng.randrange(500, 10000)) / 100
+            else:
+                sender = OWN_NAME
+                receiver = rng.choice(SUPPLIERS)
+                subject = f"{rng.choice(EXPENSE_SUBJECTS)} {n}"
+                value = -Decimal(rng.randrange(500, 50000)) / 100
+            balance += value
+            journal_file.write(
+                f"{day.day}.{day.month}.{day.year};{sender};{receiver};"
+                + f"{subject};{value:.2f};{balance:.2f}\n"
+            )
+
+
+def generate_accounts(path, depth=3, breadth=4, n_customers=10):
+    """
+    Writes an account tree to the yaml file at path: the customer accounts
+    below Debitoren, the VAT accounts below Umsatzsteuer and a tree of
+    expense accounts below Aufwendungen, breadth accounts wide and depth
+    levels deep. Returns the names of the leaf expense accounts.
+    """
+    leaves = []
+
+    def expense_tree(prefix, level):
+        if level == depth:
+            names = [f"{prefix}.{n}" for n in range(breadth)]
+            leaves.extend(names)
+            return names
+        return [
+            {f"{prefix}.{n}": expense_tree(f"{prefix}.{n}", level + 1)}
+            for n in range(breadth)
+        ]
+
+    accounts = {
+        "Debitoren": [customer_name(n) for n in range(n_customers)],
+        "Umsatzsteuer": list(VAT_ACCOUNTS),
+        "Aufwendungen": expense_tree("Aufwand", 1),
+    }
+    with open(path, "w") as account_file:
+        yaml.safe_dump(accounts, account_file, allow_unicode=True)
+    return leaves
+
+
+def customer_name(n):
+    return str(1000 + n)
+
+
+def generate_invoices(path, n_invoices, n_customers=10, seed=0, year=2019):
+    """
+    Creates n_invoices invoices in the nested directory layout of rechnung
+    (one directory per customer, a yaml and a pdf file per invoice) below
+    path. The invoices are keyed by cid, total_gross and date.
+    """
+    rng = random.Random(seed)
+    path = Path(path)
+    for n in range(n_invoices):
+        cid = customer_name(rng.randrange(n_customers))
+        invoice_date = date(year, 1, 1) + timedelta(days=rng.randrange(365))
+        total_gross = rng.randrange(1000, 20000) / 100
+        invoice_id = f"{cid}.{year}.{n}"
+        customer_dir = path / cid
+        customer_dir.mkdir(parents=True, exist_ok=True)
+        invoice = {
+            "cid": cid,
+            "date": invoice_date.strftime("%d.%m.%Y"),
+            "id": invoice_id,
+            "total_gross": total_gross,
+        }
+        with open(customer_dir / f"{invoice_id}.yaml", "w") as invoice_file:
+            yaml.safe_dump(invoice, invoice_file)
+        (customer_dir / f"{invoice_id}.pdf").write_bytes(
+            make_pdf(
+                [
+                    f"Rechnung {invoice_id}",
+                    f"Kunde {cid}",
+                    f"Datum {invoice['date']}",
+                    f"Gesamt {total_gross:.2f} EUR",
+                ]
+            )
+        )
+
+
+def make_pdf(lines):
+    """
+    Returns a minimal one page pdf document showing the given lines of text.
+    """
+    text = "".join(
+        "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '"
+        for line in lines
+    )
+    stream = f"BT /F1 12 Tf 14 TL 72 800 Td {text} ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        + b"/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    pdf += b"startxref\n%d\n%%%%EOF\n" % xref
+    return pdf
+
+
+def generate_bookings(account_ids, ratio=0.5, seed=0, batch_size=500):
+    """
+    Books the absolute value of about ratio of the journal entries to
+    accounts chosen at random from account_ids, with bulk inserts. About a
+    third of these entries is booked only partially. Returns the number
+    of bookings.
+    """
+    rng = random.Random(seed)
+    n_bookings = 0
+    last_id = 0
+    with get_db().atomic():
+        while True:
+            # The entries are read page by page, as the triggers of the
+            # bookings update them
+            entries = list(
+                JournalEntry.select(JournalEntry.id, JournalEntry.value)
+                .where(JournalEntry.id > last_id)
+                .order_by(JournalEntry.id)
+                .limit(batch_size)
+                .tuples()
+            )
+            if not entries:
+                return n_bookings
+            last_id = entries[-1][0]
+            bookings = [
+                (
+                    rng.choice(account_ids),
+                    entry_id,
+                    abs(value) if rng.random() < 0.66 else round(abs(value) / 2, 2),
+                )
+                for entry_id, value in entries
+                if rng.random() < ratio
+            ]
+            if bookings:
+                Booking.insert_many(
+                    bookings,
+                    fields=[Booking.account, Booking.journalentry, Booking.value],
+                ).execute()
+            n_bookings += len(bookings)
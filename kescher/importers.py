@@ -9,15 +9,33 @@ without having to set up everything by hand or one by one.
 import arrow
 import csv
 import logging
+import time
 import yaml
 
+from datetime import date
+from decimal import Decimal
+from kescher import stats
 from kescher.database import get_db
-from kescher.models import Account, Document, JournalEntry, VirtualBooking
+from kescher.models import (
+    Account,
+    ClosedPeriod,
+    Document,
+    DocumentContent,
+    DocumentIndex,
+    InvoiceCache,
+    JournalEntry,
+    VirtualBooking,
+)
+from kescher.parsers import iter_reversed
+from multiprocessing import Pool
 from pathlib import Path
 from pdfminer.high_level import extract_text
-from peewee import DoesNotExist
+from peewee import chunked
 from tqdm import tqdm
 
+# The loader of libyaml is much faster than the pure Python one
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 class Importer:
     """
@@ -48,50 +66,166 @@ class Importer:
 
 
 class JournalImporter(Importer):
-    def __init__(self, csv_file, delimiter=";", quotechar='"'):
+    """
+    The JournalImporter imports the rows of a (sanitized) bank statement.
+
+    Every row is stored with a fingerprint, rows which are already known
+    (e.g. from an overlapping statement) are skipped.
+    """
+
+    FIELDS = (
+        JournalEntry.date,
+        JournalEntry.sender,
+        JournalEntry.receiver,
+        JournalEntry.subject,
+        JournalEntry.value,
+        JournalEntry.balance,
+        JournalEntry.imported_at,
+        JournalEntry.fingerprint,
+        JournalEntry.updated_at,
+    )
+
+    def __init__(self, csv_file, delimiter=";", quotechar='"', batch_size=None):
         """
-        Must be given a csv file handler (and optionally delimiter and quotechar).
-        Creates the csvreader instance to be used when importing.
+        Must be given a csv file handler (and optionally delimiter, quotechar and
+        batch_size). Creates the reader of the rows to be used when importing.
+        If a batch_size is given, the rows are imported in bulk.
         """
-        self.reader = csv.reader(csv_file, delimiter=";", quotechar='"')
+        self.reader = self._make_reader(csv_file, delimiter, quotechar)
+        self.batch_size = batch_size
+        self.n_new = 0
+        self.n_duplicates = 0
         super().__init__()
 
+    @staticmethod
+    def _make_reader(csv_file, delimiter, quotechar):
+        """
+        Returns the iterator over the rows of the file.
+        """
+        return csv.reader(csv_file, delimiter=delimiter, quotechar=quotechar)
+
     def __call__(self):
         """
         To create a consistent api, all importers are callable.
         """
-        self.import_rows()
+        if self.batch_size:
+            self.import_bulk()
+        else:
+            self.import_rows()
 
     def import_rows(self):
         """
-        This functions reads all rows and creates temp objects in a list,
-        after all lines were read sucessfully, the objects are saved.
-        """
-        n_rows = 0
-        with get_db().atomic() as db:
-            for row in self._iterate_rows():
-                self.logger.debug("Creating: " + ", ".join(row))
-                self._import_row(row)
-                n_rows += 1
-            db.commit()
-        self.logger.info(f"Imported {n_rows} entries.")
-
-    def _import_row(self, row):
-        JournalEntry.create(
-            date=arrow.get(row[0], "D.M.YYYY").datetime,
-            sender=row[1],
-            receiver=row[2],
-            subject=row[3],
-            value=row[4],
-            balance=row[5],
-            imported_at=self.import_date.datetime,
-        )
+        Imports the rows one by one, all inside one transaction.
+        """
+        rows = self._iterate_parsed(self._iterate_rows())
+        with get_db().atomic():
+            for row in stats.timed("parse", rows):
+                self.logger.debug("Creating: %s", row)
+                with stats.stage("insert"):
+                    self._insert([row])
+        self._log_result()
 
     def _iterate_rows(self):
+        # Joining the row costs time even if the message is discarded
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         for row in tqdm(self.reader):
-            self.logger.debug("Reading: " + ", ".join(row))
+            if debug:
+                self.logger.debug("Reading: " + ", ".join(row))
             yield row
 
+    def import_bulk(self):
+        """
+        Parses all rows into plain tuples and writes them with multi-row
+        inserts of batch_size rows each, all inside one transaction.
+        """
+        rows = self._iterate_parsed(tqdm(self.reader))
+        with get_db().atomic():
+            for batch in stats.timed("parse", chunked(rows, self.batch_size)):
+                with stats.stage("insert"):
+                    self._insert(batch)
+                self.logger.debug("Inserted batch of %d entries.", len(batch))
+        self._log_result()
+
+    def _insert(self, rows):
+        """
+        Inserts the parsed rows, rows with a known fingerprint are ignored.
+        Like save() does for single entries, updated_at is stamped at the
+        time the rows are written.
+        """
+        updated_at = arrow.now().datetime
+        query = JournalEntry.insert_many(
+            [row + (updated_at,) for row in rows], fields=self.FIELDS
+        ).on_conflict_ignore()
+        n_inserted = get_db().execute(query).rowcount
+        self.n_new += n_inserted
+        self.n_duplicates += len(rows) - n_inserted
+
+    def _log_result(self):
+        self.logger.info(
+            f"Imported {self.n_new} entries, skipped {self.n_duplicates} duplicates."
+        )
+
+    def _iterate_parsed(self, rows):
+        """
+        Yields the parsed rows, completed by import date and fingerprint.
+        """
+        imported_at = self.import_date.datetime
+        occurrences = {}
+        for row in rows:
+            entry = self._parse_row(row)
+            occurrence = occurrences[entry] = occurrences.get(entry, 0) + 1
+            fingerprint = JournalEntry.make_fingerprint(*entry, occurrence)
+            yield entry + (imported_at, fingerprint)
+
+    @staticmethod
+    def _parse_row(row):
+        """
+        Returns the row as tuple of date, sender, receiver, subject, value
+        and balance. The date is expected in D.M.YYYY format.
+        """
+        day, month, year = row[0].split(".")
+        return (
+            date(int(year), int(month), int(day)),
+            row[1],
+            row[2],
+            row[3],
+            Decimal(row[4]),
+            Decimal(row[5]),
+        )
+
+
+class BankImporter(JournalImporter):
+    """
+    The BankImporter imports the CSV export of a bank in one pass: the rows
+    are converted by the parser of the bank (see kescher.parsers) straight
+    into journal entries, without a sanitized intermediate file.
+
+    The entries are the same as if the export was sanitized and imported by
+    the JournalImporter, so are their fingerprints.
+    """
+
+    def __init__(self, bank_file, parser, reverse=False, batch_size=None):
+        """
+        Must be given the export file handler and the parser of the bank. If
+        reverse is set, the last row of the export is imported first.
+        """
+        self.parser = parser
+        self.reverse = reverse
+        super().__init__(bank_file, batch_size=batch_size)
+
+    def _make_reader(self, bank_file, delimiter, quotechar):
+        """
+        Returns the iterator over the rows of the export, read by the parser
+        of the bank, which knows its delimiter and quotechar.
+        """
+        reader = self.parser.iter_rows(bank_file)
+        if self.reverse:
+            reader = iter_reversed(reader)
+        return reader
+
+    def _parse_row(self, row):
+        return self.parser.get_journal_entry(row)
+
 
 class AccountImporter(Importer):
     """
@@ -103,14 +237,14 @@ class AccountImporter(Importer):
 
     def __init__(self, account_file):
         """
-        Must be given the account file. Database connection is already established
-        at this point, as the parents are referenced accross functions, and we
-        need an established connection to allow this.
+        Must be given the account file.
         """
         self.account_file = account_file
         self.n_accounts = 0
+        self.n_added = 0
+        self.n_unchanged = 0
+        self.orphaned = []
         super().__init__()
-        self.db = get_db().connection()
 
     def __call__(self):
         """
@@ -121,65 +255,124 @@ class AccountImporter(Importer):
     def import_accounts(self):
         """
         This wrapper function is to to be called from external
-        functions or __call__(). After importing the accounts
-        it deletes the class instance and closes the db connection,
-        to ensure the db connection is not left open, and then not run again.
+        functions or __call__(). The tree is built in memory and inserted
+        level by level inside one transaction. Accounts which exist already
+        are left as they are, thus an amended account file can be imported
+        again. Existing accounts, which are not in the file, are orphaned.
         """
-        data = yaml.safe_load(self.account_file)
-        self._iterate_accounts(data)
-        self.logger.info(f"Imported {self.n_accounts} accounts.")
-        self.db.close()
-        del self
+        with stats.stage("parse"):
+            data = yaml.load(self.account_file, Loader=SafeLoader)
+            levels = []
+            self._iterate_accounts(data, (), levels, set())
+        with stats.stage("insert"), get_db().atomic():
+            existing = {
+                (name, parent_id): account_id
+                for account_id, name, parent_id in Account.select(
+                    Account.id, Account.name, Account.parent
+                ).tuples()
+            }
+            names = {account_id: name for (name, _), account_id in existing.items()}
+            ids = {}
+            for level in levels:
+                keys = [(path[-1], ids.get(path[:-1])) for path in level]
+                missing = [key for key in keys if key not in existing]
+                self.logger.debug(
+                    "Level %s: %s accounts, %s new",
+                    len(level[0]),
+                    len(keys),
+                    len(missing),
+                )
+                if missing:
+                    existing.update(Account.create_many(missing))
+                ids.update((path, existing[key]) for path, key in zip(level, keys))
+                self.n_added += len(missing)
+                self.n_unchanged += len(keys) - len(missing)
+        imported = set(ids.values())
+        self.orphaned = sorted(
+            name for account_id, name in names.items() if account_id not in imported
+        )
+        self.n_accounts = self.n_added + self.n_unchanged
+        self.logger.info(
+            f"Imported {self.n_accounts} accounts: {self.n_added} added, "
+            + f"{self.n_unchanged} unchanged, {len(self.orphaned)} orphaned."
+        )
 
-    def _iterate_accounts(self, data, parent=None):
+    def _iterate_accounts(self, data, parent, levels, seen):
         """
-        Iterates over the data (tree) recursively.
+        Iterates over the data (tree) recursively and appends the path of
+        each account (the names from the top level account down to the
+        account) to the list of its level.
         """
-        self.logger.debug(f"Iterate accounts with parent {parent}")
         if isinstance(data, list):
-            self._create_accounts(data, parent)
-            return
+            for account in data:
+                if isinstance(account, str):
+                    self._add_account(parent + (account,), levels, seen)
+                elif isinstance(account, dict):
+                    self._iterate_accounts(account, parent, levels, seen)
+                else:
+                    self.logger.debug("account: %s is %s", account, type(account))
+                    raise TypeError("accounts to be created must be str")
         elif isinstance(data, dict):
             for account, children in data.items():
-                new_parent = Account(name=account, parent=parent)
-                new_parent.save()
-                self.n_accounts += 1
-                self.logger.debug(
-                    f"Created parent {new_parent}. Now creating {children}."
-                )
-                self._iterate_accounts(children, new_parent)
+                path = parent + (account,)
+                self._add_account(path, levels, seen)
+                self._iterate_accounts(children, path, levels, seen)
         else:
             raise TypeError("accounts must be in list or dict")
 
-    def _create_accounts(self, accounts, parent=None):
-        """
-        Creates all accounts in list, if they are are string, or calls
-        _iterate_accounts() again, if they are dict.
-        """
-        for account in accounts:
-            if isinstance(account, str):
-                Account.create(name=account, parent=parent)
-                self.n_accounts += 1
-            elif isinstance(account, dict):
-                self._iterate_accounts(account, parent)
-            else:
-                self.logger.debug(f"account: {account} is {type(account)}")
-                raise TypeError("accounts to be created must be str")
+    def _add_account(self, path, levels, seen):
+        if path in seen:
+            return
+        seen.add(path)
+        if len(levels) < len(path):
+            levels.append([])
+        levels[len(path) - 1].append(path)
+
+
+def hash_document(doc_path):
+    """
+    Returns the path, the hash of the document and the seconds spent hashing.
+    """
+    start = time.perf_counter()
+    doc_hash = Document.make_hash(doc_path)
+    return doc_path, doc_hash, time.perf_counter() - start
+
+
+def extract_document(doc_path):
+    """
+    Returns the path, the text of the document and the seconds spent extracting.
+    """
+    start = time.perf_counter()
+    doc_content = extract_text(doc_path)
+    return doc_path, doc_content, time.perf_counter() - start
 
 
 class DocumentImporter(Importer):
     """
     The DocumentImporter assists for bulk importing documents.
+
+    Hashing and text extraction may be spread over a pool of jobs processes,
+    while the documents are written to the database by this process only.
+    Documents whose size, mtime and inode did not change since they were
+    imported are skipped without being read, unless verify is set.
+
+    The text is extracted once per hash: new documents with the same content
+    as another document share its DocumentContent and are not extracted.
     """
 
     EXTENSION = ".pdf"
+    BATCH_SIZE = 50
 
-    def __init__(self, path, flat=True):
+    def __init__(self, path, flat=True, jobs=1, verify=False):
         self.n_new_documents = 0
+        self.n_extracted_documents = 0
+        self.n_unchanged_documents = 0
         if not isinstance(path, Path):
             path = Path(path)
         self.path = path
         self.flat = flat
+        self.jobs = jobs
+        self.verify = verify
         super().__init__()
 
     def __call__(self):
@@ -190,75 +383,349 @@ class DocumentImporter(Importer):
             doc_iterator = self._iterate_flat
         else:
             doc_iterator = self._iterate_nested
+        known = {
+            path: (doc_id, doc_hash, (size, mtime, inode))
+            for doc_id, path, doc_hash, size, mtime, inode in Document.select(
+                Document.id,
+                Document.path,
+                Document.hash,
+                Document.size,
+                Document.mtime,
+                Document.inode,
+            ).tuples()
+        }
+        signatures = {}
+        doc_paths = []
         for doc_path in doc_iterator():
-            exists = True
-            doc_hash = Document.make_hash(doc_path)
-            self.logger.debug(f"Importing {doc_path} ({doc_hash}).")
-
-            try:
-                doc_db = Document.get(Document.path == str(doc_path))
-            except DoesNotExist:
-                exists = False
-
-            if not exists:
-                self.logger.debug(f"{doc_path} not found in db. Importing...")
-                doc_content = extract_text(doc_path)
-                Document.create(content=doc_content, hash=doc_hash, path=doc_path)
-                self.n_new_documents += 1
+            signature = signatures[doc_path] = Document.make_signature(doc_path)
+            known_doc = known.get(str(doc_path))
+            if known_doc is None or self.verify or known_doc[2] != signature:
+                doc_paths.append(doc_path)
             else:
-                self.logger.debug(f"Checking hash of existing document {doc_path} ...")
-                if not doc_db.hash == doc_hash:
+                self.n_unchanged_documents += 1
+        if self.jobs > 1:
+            with Pool(self.jobs) as pool:
+                self._import(doc_paths, known, signatures, pool.imap_unordered)
+        else:
+            self._import(doc_paths, known, signatures, map)
+        self.logger.info(
+            f"Imported {self.n_new_documents} new documents "
+            + f"({self.n_extracted_documents} extracted), "
+            + f"skipped {self.n_unchanged_documents} unchanged documents."
+        )
+
+    def _import(self, doc_paths, known, signatures, map_function):
+        """
+        Hashes the documents, extracts the text of the new hashes and writes
+        the documents. map_function maps the worker functions over the paths.
+        """
+        hashes = {}
+        for doc_path, doc_hash, hash_time in map_function(hash_document, doc_paths):
+            self.logger.debug("Hashed %s (%s).", doc_path, doc_hash)
+            stats.add_stage("hash", hash_time)
+            hashes[doc_path] = doc_hash
+        new_paths = [doc_path for doc_path in doc_paths if str(doc_path) not in known]
+        self._check_documents(
+            [doc_path for doc_path in doc_paths if str(doc_path) in known],
+            hashes,
+            known,
+            signatures,
+        )
+        first_paths = {}
+        for doc_path in new_paths:
+            first_paths.setdefault(hashes[doc_path], doc_path)
+        stored = set()
+        for batch in chunked(list(first_paths), self.BATCH_SIZE):
+            stored.update(
+                document_content.hash
+                for document_content in DocumentContent.select(
+                    DocumentContent.hash
+                ).where(DocumentContent.hash.in_(batch))
+            )
+        to_extract = [
+            doc_path
+            for doc_hash, doc_path in first_paths.items()
+            if doc_hash not in stored
+        ]
+        extracted = map_function(extract_document, to_extract)
+        self._insert_contents(tqdm(extracted, total=len(to_extract)), hashes)
+        self._insert_documents(new_paths, hashes, signatures)
+        self.n_new_documents += len(new_paths)
+        self.n_extracted_documents += len(to_extract)
+
+    def _check_documents(self, doc_paths, hashes, known, signatures):
+        """
+        Checks the hashes of the already existing documents. If the hash of a
+        document still matches, its new signature is stored.
+        """
+        updated_at = arrow.now().datetime
+        with stats.stage("insert"), get_db().atomic():
+            for doc_path in doc_paths:
+                self.logger.debug("Checking hash of existing document %s ...", doc_path)
+                doc_id, known_hash, _ = known[str(doc_path)]
+                if not known_hash == hashes[doc_path]:
                     self.logger.warning(
                         f"Hashes of existing and to-be-imported {doc_path} don't match!"
                     )
-                else:
-                    self.logger.debug(
-                        f"Hash {doc_hash} of doc to be imported matches hash in db."
-                    )
-        self.logger.info(f"Imported {self.n_new_documents} new documents.")
+                    continue
+                self.logger.debug(
+                    "Hash %s of doc to be imported matches hash in db.", known_hash
+                )
+                size, mtime, inode = signatures[doc_path]
+                Document.update(
+                    size=size, mtime=mtime, inode=inode, updated_at=updated_at
+                ).where(Document.id == doc_id).execute()
+
+    def _insert_contents(self, extracted, hashes):
+        """
+        Inserts the compressed contents of the extracted documents by their
+        hash in batched transactions and adds them to the full-text index.
+        """
+        for batch in chunked(extracted, self.BATCH_SIZE):
+            contents = {}
+            for doc_path, doc_content, extract_time in batch:
+                stats.add_stage("extract", extract_time)
+                contents[hashes[doc_path]] = doc_content
+            updated_at = arrow.now().datetime
+            with stats.stage("insert"), get_db().atomic():
+                DocumentContent.insert_many(
+                    [
+                        {"hash": doc_hash, "text": text, "updated_at": updated_at}
+                        for doc_hash, text in contents.items()
+                    ]
+                ).execute()
+                new_ids = (
+                    DocumentContent.select(DocumentContent.id, DocumentContent.hash)
+                    .where(DocumentContent.hash.in_(list(contents)))
+                    .tuples()
+                )
+                DocumentIndex.insert_many(
+                    [
+                        {"rowid": content_id, "content": contents[doc_hash]}
+                        for content_id, doc_hash in new_ids
+                    ]
+                ).execute()
+
+    def _insert_documents(self, doc_paths, hashes, signatures):
+        """
+        Inserts the new documents, after their contents, in one transaction.
+        """
+        updated_at = arrow.now().datetime
+        with stats.stage("insert"), get_db().atomic():
+            for batch in chunked(doc_paths, self.BATCH_SIZE):
+                Document.insert_many(
+                    [
+                        {
+                            "hash": hashes[doc_path],
+                            "path": str(doc_path),
+                            "size": signatures[doc_path][0],
+                            "mtime": signatures[doc_path][1],
+                            "inode": signatures[doc_path][2],
+                            "updated_at": updated_at,
+                        }
+                        for doc_path in batch
+                    ]
+                ).execute()
+
+
+def parse_invoice(task):
+    """
+    Returns the path and the id, account, amount and date of the invoice file.
+    """
+    invoice_path, account_key, amount_key, date_key = task
+    with open(invoice_path) as infile:
+        invoice = yaml.load(infile, Loader=SafeLoader)
+    return invoice_path, (
+        str(invoice["id"]),
+        str(invoice[account_key]),
+        Decimal(str(invoice[amount_key])),
+        arrow.get(invoice[date_key], "DD.MM.YYYY").date(),
+    )
 
 
 class InvoiceImporter(Importer):
+    """
+    The InvoiceImporter creates a virtual booking for each invoice (a yaml
+    file) and imports the documents (pdf files) of the invoices.
+
+    The documents and accounts are read once, missing accounts are created
+    and the virtual bookings inserted in bulk, all in one transaction. The
+    virtual bookings store the id of their invoice, invoices which were
+    already imported are skipped, as are invoices dated within a locked
+    period.
+
+    The yaml files may be parsed by a pool of jobs processes. The values read
+    from them are kept in the InvoiceCache, files whose mtime did not change
+    since are not parsed again.
+    """
 
     EXTENSION = ".yaml"
+    BATCH_SIZE = 100
+    PARSE_CHUNK_SIZE = 64
 
-    def __init__(self, path, account_key, amount_key, date_key, flat=False):
+    def __init__(
+        self, path, account_key, amount_key, date_key, flat=False, jobs=1, verify=False
+    ):
         if not isinstance(path, Path):
             path = Path(path)
         self.path = path
         self.flat = flat
+        self.jobs = jobs
+        self.verify = verify
         self.account_key = account_key
         self.amount_key = amount_key
         self.date_key = date_key
+        self.n_new = 0
+        self.n_duplicates = 0
+        self.n_locked = 0
         super().__init__()
 
     def __call__(self):
         self.import_invoices()
 
     def import_invoices(self):
-        self.logger.debug(f"Importing invoices from {self.path}.")
+        self.logger.debug("Importing invoices from %s.", self.path)
         # First we need to import the Documents
-        DocumentImporter(self.path, self.flat)()
+        DocumentImporter(self.path, self.flat, self.jobs, self.verify)()
 
         if self.flat:
             invoice_iterator = self._iterate_flat
         else:
             invoice_iterator = self._iterate_nested
-        for invoice_path in invoice_iterator():
-            with open(invoice_path) as infile:
-                invoice = yaml.safe_load(infile)
-            document = Document.get_or_none(
-                Document.path == invoice_path.with_suffix(DocumentImporter.EXTENSION)
+        mtimes = {str(path): path.stat().st_mtime_ns for path in invoice_iterator()}
+        keys = "\n".join((self.account_key, self.amount_key, self.date_key))
+        values = {
+            path: tuple(cached)
+            for path, mtime, *cached in InvoiceCache.select(
+                InvoiceCache.path,
+                InvoiceCache.mtime,
+                InvoiceCache.invoice,
+                InvoiceCache.account,
+                InvoiceCache.value,
+                InvoiceCache.date,
+            )
+            .where(InvoiceCache.keys == keys)
+            .tuples()
+            if mtimes.get(path) == mtime
+        }
+        self.logger.debug("%d invoices are unchanged.", len(values))
+        parsed = self._parse_invoices(
+            [
+                (path, self.account_key, self.amount_key, self.date_key)
+                for path in mtimes
+                if path not in values
+            ]
+        )
+        values.update(parsed)
+
+        invoices = []
+        for path in mtimes:
+            self.logger.debug("Importing invoice %s...", values[path][0])
+            doc_path = str(Path(path).with_suffix(DocumentImporter.EXTENSION))
+            invoices.append(values[path] + (doc_path,))
+        with stats.stage("insert"), get_db().atomic():
+            for batch in chunked(parsed.items(), self.BATCH_SIZE):
+                InvoiceCache.insert_many(
+                    [(path, mtimes[path], keys, *value) for path, value in batch],
+                    fields=[
+                        InvoiceCache.path,
+                        InvoiceCache.mtime,
+                        InvoiceCache.keys,
+                        InvoiceCache.invoice,
+                        InvoiceCache.account,
+                        InvoiceCache.value,
+                        InvoiceCache.date,
+                    ],
+                ).on_conflict_replace().execute()
+            self._insert_invoices(invoices)
+        self.logger.info(
+            f"Imported {self.n_new} invoices, skipped {self.n_duplicates} duplicates "
+            + f"and {self.n_locked} in locked periods."
+        )
+
+    def _parse_invoices(self, tasks):
+        """
+        Parses the invoice files, in a pool of jobs processes if given.
+        Returns the values of the invoices by path.
+        """
+        if self.jobs > 1 and len(tasks) > 1:
+            with Pool(self.jobs) as pool:
+                parsed = pool.imap(parse_invoice, tasks, self.PARSE_CHUNK_SIZE)
+                return dict(stats.timed("parse", parsed))
+        return dict(stats.timed("parse", map(parse_invoice, tasks)))
+
+    def _skip_locked(self, invoices):
+        """
+        Returns the invoices not dated within a locked period, whose virtual
+        bookings would be refused. Of the others, those already imported are
+        counted as duplicates.
+        """
+        locked_ranges = ClosedPeriod.locked_ranges()
+        if not locked_ranges:
+            return invoices
+        unlocked = []
+        locked_ids = []
+        for invoice in invoices:
+            invoice_date = invoice[3]
+            if any(start <= invoice_date <= end for start, end in locked_ranges):
+                locked_ids.append(invoice[0])
+            else:
+                unlocked.append(invoice)
+        n_imported = 0
+        for batch in chunked(locked_ids, self.BATCH_SIZE):
+            n_imported += (
+                VirtualBooking.select().where(VirtualBooking.invoice.in_(batch)).count()
             )
-            self.logger.debug(f"Importing invoice {invoice['id']}...")
-            account, created = Account.get_or_create(
-                name=str(invoice[self.account_key])
+        self.n_duplicates += n_imported
+        self.n_locked += len(locked_ids) - n_imported
+        return unlocked
+
+    def _insert_invoices(self, invoices):
+        """
+        Inserts the virtual bookings of the invoices, creating the accounts
+        which do not exist yet.
+        """
+        invoices = self._skip_locked(invoices)
+        documents = dict(Document.select(Document.path, Document.id).tuples())
+        accounts = {}
+        for name, account_id in (
+            Account.select(Account.name, Account.id).order_by(Account.id).tuples()
+        ):
+            accounts.setdefault(name, account_id)
+        new_accounts = {name for _, name, *_ in invoices} - set(accounts)
+        if new_accounts:
+            self.logger.debug("Creating new accounts %s...", new_accounts)
+            created = Account.create_many(
+                [(name, None) for name in sorted(new_accounts)]
             )
-            if created:
-                self.logger.debug(f"Created new account {account}...")
-            VirtualBooking.create(
-                account_id=account.id,
-                document_id=document.id,
-                value=invoice[self.amount_key],
-                date=arrow.get(invoice[self.date_key], "DD.MM.YYYY").datetime,
+            accounts.update(
+                (name, account_id) for (name, _), account_id in created.items()
             )
+
+        updated_at = arrow.now().datetime
+        rows = (
+            (
+                accounts[account_name],
+                documents.get(doc_path),
+                value,
+                invoice_date,
+                invoice_id,
+                updated_at,
+            )
+            for invoice_id, account_name, value, invoice_date, doc_path in invoices
+        )
+        for batch in chunked(rows, self.BATCH_SIZE):
+            query = VirtualBooking.insert_many(
+                batch,
+                fields=[
+                    VirtualBooking.account,
+                    VirtualBooking.document,
+                    VirtualBooking.value,
+                    VirtualBooking.date,
+                    VirtualBooking.invoice,
+                    VirtualBooking.updated_at,
+                ],
+            ).on_conflict_ignore()
+            n_inserted = get_db().execute(query).rowcount
+            self.n_new += n_inserted
+            self.n_duplicates += len(batch) - n_inserted
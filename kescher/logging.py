@@ -4,11 +4,14 @@ import logging
 def setup_logging(cwd):
     """
     Creates and returnes a logger with the default logging level "INFO"
-    in the current working directory.
+    in the current working directory. The log file is only opened, once
+    the first message is logged.
     """
     logger = logging.getLogger("kescher")
     logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(cwd / "kescher.log")
+    if logger.handlers:
+        return logger
+    handler = logging.FileHandler(cwd / "kescher.log", delay=True)
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
@@ -0,0 +1,302 @@
+"""
+Migrations bring databases created by earlier versions of kescher up to
+date with the current models. The version of a database is stored in its
+user_version, i.e. the number of migrations applied to it.
+"""
+import logging
+import yaml
+import zlib
+
+from datetime import date
+from decimal import Decimal
+from kescher.importers import InvoiceImporter, SafeLoader
+from kescher.models import BOOKED_STATUS, JournalEntry
+from pathlib import Path
+from peewee import chunked
+from playhouse.migrate import SqliteMigrator, migrate
+
+logger = logging.getLogger("kescher.migrations")
+
+# The indexes as created by the migration create_indexes
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS journalentry_date ON journalentry (date)",
+    "CREATE INDEX IF NOT EXISTS virtualbooking_date ON virtualbooking (date)",
+    "CREATE INDEX IF NOT EXISTS booking_account_id_journalentry_id_value "
+    + "ON booking (account_id, journalentry_id, value)",
+    "CREATE INDEX IF NOT EXISTS virtualbooking_account_id_date_value "
+    + "ON virtualbooking (account_id, date, value)",
+)
+
+
+def database_size(database):
+    """
+    Returns the size of the database in bytes.
+    """
+    page_count = database.execute_sql("PRAGMA page_count").fetchone()[0]
+    page_size = database.execute_sql("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def migrate_document_content(database, batch_size=100):
+    """
+    Moves the extracted text of all documents from the document table into
+    the compressed documentcontent table (keyed by the document, as of this
+    version) and drops the content column. Returns the number of migrated
+    documents.
+    """
+    columns = [column.name for column in database.get_columns("document")]
+    if "content" not in columns:
+        return 0
+    n_documents = 0
+    with database.atomic():
+        database.execute_sql(
+            "CREATE TABLE IF NOT EXISTS documentcontent ("
+            + "document_id INTEGER NOT NULL PRIMARY KEY, updated_at DATETIME, "
+            + "text BLOB NOT NULL, "
+            + "FOREIGN KEY (document_id) REFERENCES document (id) ON DELETE CASCADE)"
+        )
+        cursor = database.execute_sql(
+            "SELECT id, content, updated_at FROM document WHERE content IS NOT NULL"
+        )
+        for batch in chunked(cursor, batch_size):
+            for doc_id, content, updated_at in batch:
+                database.execute_sql(
+                    "INSERT OR IGNORE INTO documentcontent "
+                    + "(document_id, text, updated_at) VALUES (?, ?, ?)",
+                    (doc_id, zlib.compress(content.encode()), updated_at),
+                )
+            n_documents += len(batch)
+        migrate(SqliteMigrator(database).drop_column("document", "content"))
+    return n_documents
+
+
+def add_fingerprints(database):
+    """
+    Adds the fingerprint to the journal entries and computes it for the
+    existing ones, counting the occurrences of identical rows per import
+    (imported_at) like the JournalImporter does per file. Of entries with the
+    same fingerprint, i.e. rows imported more than once, only the first gets
+    it. Then the fingerprints are indexed uniquely. Returns the number of
+    fingerprinted entries.
+    """
+    columns = [column.name for column in database.get_columns("journalentry")]
+    if "fingerprint" in columns:
+        return 0
+    with database.atomic():
+        database.execute_sql(
+            "ALTER TABLE journalentry ADD COLUMN fingerprint VARCHAR(255)"
+        )
+        cursor = database.execute_sql(
+            "SELECT id, imported_at, date, sender, receiver, subject, value, balance "
+            + "FROM journalentry ORDER BY imported_at, id"
+        )
+        occurrences = {}
+        fingerprints = set()
+        for entry_id, imported_at, *row in cursor.fetchall():
+            entry = (
+                date.fromisoformat(str(row[0])),
+                *row[1:4],
+                Decimal(str(row[4])),
+                Decimal(str(row[5])),
+            )
+            occurrence = occurrences[imported_at, entry] = (
+                occurrences.get((imported_at, entry), 0) + 1
+            )
+            fingerprint = JournalEntry.make_fingerprint(*entry, occurrence)
+            if fingerprint in fingerprints:
+                continue
+            fingerprints.add(fingerprint)
+            database.execute_sql(
+                "UPDATE journalentry SET fingerprint = ? WHERE id = ?",
+                (fingerprint, entry_id),
+            )
+        database.execute_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS journalentry_fingerprint "
+            + "ON journalentry (fingerprint)"
+        )
+    return len(fingerprints)
+
+
+def add_document_signatures(database):
+    """
+    Adds size, mtime and inode of the files to the documents. They are
+    stored, when the documents are imported again.
+    """
+    columns = [column.name for column in database.get_columns("document")]
+    with database.atomic():
+        for column in ("size", "mtime", "inode"):
+            if column not in columns:
+                database.execute_sql(
+                    f"ALTER TABLE document ADD COLUMN {column} INTEGER"
+                )
+
+
+def create_indexes(database):
+    """
+    Creates the indexes of the dates and the covering indexes of the
+    bookings per account, which the saldo and filter queries rely on.
+    """
+    with database.atomic():
+        for index in INDEXES:
+            database.execute_sql(index)
+
+
+def add_booked_status(database):
+    """
+    Adds the booked amount and the status to the journal entries and fills
+    them from the existing bookings.
+    """
+    with database.atomic():
+        database.execute_sql(
+            "ALTER TABLE journalentry ADD COLUMN booked DECIMAL(10, 5) NOT NULL DEFAULT 0"
+        )
+        database.execute_sql(
+            "ALTER TABLE journalentry ADD COLUMN status VARCHAR(255) NOT NULL "
+            + "DEFAULT 'unbooked'"
+        )
+        database.execute_sql("""
+            UPDATE journalentry SET booked = (
+                SELECT COALESCE(SUM(value), 0) FROM booking
+                WHERE journalentry_id = journalentry.id
+            )
+            """)
+        database.execute_sql(f"UPDATE journalentry SET status = {BOOKED_STATUS}")
+        database.execute_sql(
+            "CREATE INDEX IF NOT EXISTS journalentry_status ON journalentry (status)"
+        )
+
+
+def add_invoice_ids(database):
+    """
+    Adds the id of the invoice to the virtual bookings, s.t. invoices are
+    imported once. The existing virtual bookings get the id read from the
+    invoice file next to their document, as the InvoiceImporter does. If
+    the file cannot be read, the id is left NULL. If an invoice was imported
+    more than once, only the first virtual booking gets the id.
+    """
+    with database.atomic():
+        database.execute_sql(
+            "ALTER TABLE virtualbooking ADD COLUMN invoice VARCHAR(255)"
+        )
+        database.execute_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS virtualbooking_invoice "
+            + "ON virtualbooking (invoice)"
+        )
+        # Setting the invoice ids must not be refused in locked periods, the
+        # trigger is created again by create_tables
+        database.execute_sql("DROP TRIGGER IF EXISTS virtualbooking_lock_update")
+        cursor = database.execute_sql(
+            "SELECT virtualbooking.id, document.path FROM virtualbooking "
+            + "JOIN document ON document.id = virtualbooking.document_id "
+            + "ORDER BY virtualbooking.id"
+        )
+        invoice_ids = {}
+        for virtual_booking_id, path in cursor.fetchall():
+            if path not in invoice_ids:
+                invoice_ids[path] = read_invoice_id(path)
+            if invoice_ids[path] is None:
+                continue
+            database.execute_sql(
+                "UPDATE OR IGNORE virtualbooking SET invoice = ? WHERE id = ?",
+                (invoice_ids[path], virtual_booking_id),
+            )
+
+
+def read_invoice_id(doc_path):
+    """
+    Returns the id of the invoice of the document at doc_path, or None if
+    its invoice file cannot be read.
+    """
+    invoice_path = Path(doc_path).with_suffix(InvoiceImporter.EXTENSION)
+    try:
+        with open(invoice_path) as infile:
+            invoice = yaml.load(infile, Loader=SafeLoader)
+        return str(invoice["id"])
+    except (OSError, yaml.YAMLError, TypeError, KeyError) as e:
+        logger.warning(f"Cannot read the invoice id from {invoice_path}: {e}")
+        return None
+
+
+def address_document_content(database):
+    """
+    Keys the extracted texts by the hash of their documents, s.t. all
+    documents with the same content share one text, and indexes the hashes.
+    Of the texts of documents with the same hash, the first is kept. The
+    full-text index is dropped, as its rowids become the ids of the texts,
+    create_tables builds it again. Returns the number of texts dropped.
+    """
+    with database.atomic():
+        n_before = database.execute_sql(
+            "SELECT COUNT(*) FROM documentcontent"
+        ).fetchone()[0]
+        database.execute_sql(
+            "ALTER TABLE documentcontent RENAME TO documentcontent_old"
+        )
+        database.execute_sql(
+            "CREATE TABLE documentcontent (id INTEGER NOT NULL PRIMARY KEY, "
+            + "updated_at DATETIME, hash VARCHAR(255) NOT NULL, text BLOB NOT NULL)"
+        )
+        database.execute_sql(
+            "CREATE UNIQUE INDEX documentcontent_hash ON documentcontent (hash)"
+        )
+        database.execute_sql("""
+            INSERT OR IGNORE INTO documentcontent (hash, text, updated_at)
+            SELECT document.hash, old.text, old.updated_at
+            FROM documentcontent_old AS old
+            JOIN document ON document.id = old.document_id
+            ORDER BY document.id
+            """)
+        database.execute_sql("DROP TABLE documentcontent_old")
+        database.execute_sql(
+            "CREATE INDEX IF NOT EXISTS document_hash ON document (hash)"
+        )
+        database.execute_sql("DROP TRIGGER IF EXISTS document_index_delete")
+        database.execute_sql("DROP TABLE IF EXISTS documentindex")
+        n_after = database.execute_sql(
+            "SELECT COUNT(*) FROM documentcontent"
+        ).fetchone()[0]
+    return n_before - n_after
+
+
+def slim_document_index(database):
+    """
+    Drops the full-text index of the documents, which stored a copy of every
+    text, and its trigger. create_tables builds it again, reading the texts
+    from the documentcontent table.
+    """
+    with database.atomic():
+        database.execute_sql("DROP TRIGGER IF EXISTS documentcontent_index_delete")
+        database.execute_sql("DROP TABLE IF EXISTS documentindex")
+
+
+MIGRATIONS = (
+    migrate_document_content,
+    add_fingerprints,
+    add_document_signatures,
+    create_indexes,
+    add_booked_status,
+    add_invoice_ids,
+    address_document_content,
+    slim_document_index,
+)
+
+
+def migrate_database(database):
+    """
+    Applies all migrations the database has not seen yet, in order. A new
+    database is created from the current models and thus only marked as
+    up to date. Returns the results of the applied migrations by their names.
+    """
+    if not database.get_tables():
+        database.user_version = len(MIGRATIONS)
+        return {}
+    applied = {}
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if database.user_version >= version:
+            continue
+        logger.info(f"Applying migration {version}: {migration.__name__}")
+        result = migration(database)
+        logger.debug(f"Migration {migration.__name__} returned {result}")
+        database.user_version = version
+        applied[migration.__name__] = result
+    return applied
@@ -1,18 +1,31 @@
-import arrow
 import hashlib
+import zlib
 
+from datetime import datetime
+from decimal import Decimal
 from kescher.database import get_db
 from pathlib import Path
 from peewee import (
+    BigIntegerField,
+    BooleanField,
+    BlobField,
     CharField,
+    CompositeKey,
     DateField,
     DateTimeField,
     DecimalField,
     Field,
     ForeignKeyField,
+    IntegerField,
     Model,
-    TextField,
+    SQL,
+    Value,
+    chunked,
+    fn,
 )
+from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
+
+HASH_BUFFER_SIZE = 1024 * 1024
 
 
 class BaseModel(Model):
@@ -23,7 +36,7 @@ class BaseModel(Model):
         database = get_db()
 
     def save(self, *args, **kwargs):
-        self.updated_at = arrow.now().datetime
+        self.updated_at = datetime.now().astimezone()
         return super().save(*args, **kwargs)
 
 
@@ -37,32 +50,102 @@ class PathField(Field):
         return Path(value)
 
 
+class CompressedTextField(BlobField):
+    """
+    Stores text zlib compressed.
+    """
+
+    def db_value(self, value):
+        if value is None:
+            return None
+        return super().db_value(zlib.compress(value.encode()))
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return zlib.decompress(value).decode()
+
+
 class Document(BaseModel):
     """
-    A Document is an invoice/receipt which reasons a JournalEntry.
+    A Document is an invoice/receipt which reasons a JournalEntry. Documents
+    are addressed by the hash of their content as well: all paths of the same
+    file share one DocumentContent.
     """
 
-    content = TextField()
     path = CharField(unique=True)
-    hash = CharField()
+    hash = CharField(index=True)
+    size = BigIntegerField(null=True)
+    mtime = BigIntegerField(null=True)
+    inode = BigIntegerField(null=True)
+
+    @staticmethod
+    def make_signature(path):
+        """
+        Returns size, mtime (in ns) and inode of the file. If the signature
+        did not change since the last import, the file is considered unchanged.
+        """
+        stat = path.stat()
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
 
     @staticmethod
     def make_hash(path):
+        """
+        Returns the sha256 of the file, which is read into a buffer of
+        HASH_BUFFER_SIZE bytes.
+        """
         h = hashlib.sha256()
-        with open(path, "rb") as infile:
-            chunk = 0
-            while chunk != b"":
-                chunk = infile.read(1024)
-                h.update(chunk)
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with open(path, "rb", buffering=0) as infile:
+            n_bytes = infile.readinto(buffer)
+            while n_bytes:
+                h.update(view[:n_bytes])
+                n_bytes = infile.readinto(buffer)
         return h.hexdigest()
 
+    @property
+    def content(self):
+        """
+        The text extracted from the document, which is only loaded on access.
+        """
+        document_content = DocumentContent.get_or_none(
+            DocumentContent.hash == self.hash
+        )
+        if document_content is None:
+            return None
+        return document_content.text
+
+    def get_paths(self):
+        """
+        Returns the paths of all documents with the same content.
+        """
+        return [
+            document.path
+            for document in Document.select(Document.path)
+            .where(Document.hash == self.hash)
+            .order_by(Document.path)
+        ]
+
+
+class DocumentContent(BaseModel):
+    """
+    The text extracted from the documents of one hash. It is stored
+    compressed and apart from the Document, s.t. the document rows, which are
+    joined by JournalEntry and VirtualBooking, stay small. Its id is the rowid
+    of the DocumentIndex.
+    """
+
+    hash = CharField(unique=True)
+    text = CompressedTextField()
+
 
 class JournalEntry(BaseModel):
     """
     A JournalEntry is one row (line) in your imported journal (bank statement).
     """
 
-    date = DateField()
+    date = DateField(index=True)
     sender = CharField()
     receiver = CharField()
     subject = CharField()
@@ -70,6 +153,33 @@ class JournalEntry(BaseModel):
     value = DecimalField()
     balance = DecimalField()
     imported_at = DateTimeField()
+    fingerprint = CharField(null=True, unique=True)
+    # Sum of the bookings and whether it matches the value, kept current by
+    # the triggers in BOOKED_TRIGGERS
+    booked = DecimalField(default=0, constraints=[SQL("DEFAULT 0")])
+    status = CharField(
+        default="unbooked", index=True, constraints=[SQL("DEFAULT 'unbooked'")]
+    )
+
+    @staticmethod
+    def make_fingerprint(date, sender, receiver, subject, value, balance, occurrence):
+        """
+        Identifies a row of a bank statement, s.t. it is recognized when it is
+        imported again. Identical rows within one statement are told apart by
+        their occurrence count.
+        """
+        key = "\x1f".join(
+            (
+                date.isoformat(),
+                sender,
+                receiver,
+                subject,
+                f"{Decimal(value).normalize():f}",
+                f"{Decimal(balance).normalize():f}",
+                str(occurrence),
+            )
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
 
     def __str__(self):
         return (
@@ -95,6 +205,125 @@ class Account(BaseModel):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Saves the account, new accounts are added to the AccountClosure.
+        """
+        is_new = self.id is None
+        result = super().save(*args, **kwargs)
+        if is_new:
+            AccountClosure.add(self.id, self.parent_id)
+        return result
+
+    @classmethod
+    def create_many(cls, accounts, batch_size=300):
+        """
+        Creates the accounts, given as (name, parent id) tuples, with bulk
+        inserts and adds them to the AccountClosure. Returns the ids of the new
+        accounts by (name, parent id). The parents must exist already, e.g. one
+        level of the tree is created at a time. As the new accounts are
+        selected by their ids, the caller should hold a transaction.
+        """
+        database = cls._meta.database
+        # Formatted once, as sqlite3 would do for every row
+        updated_at = datetime.now().astimezone().isoformat(" ")
+        last_id = cls.select(fn.MAX(cls.id)).scalar() or 0
+        # Building an insert_many query per batch takes longer than executing
+        # it, so the parameterized statement is prepared once per batch size,
+        # and the new rows are read without converting them to models
+        statements = {}
+        for batch in chunked(accounts, batch_size):
+            if len(batch) not in statements:
+                statements[len(batch)] = (
+                    "INSERT OR IGNORE INTO account (name, parent_id, updated_at) "
+                    + "VALUES "
+                    + ", ".join(["(?, ?, ?)"] * len(batch))
+                )
+            database.execute_sql(
+                statements[len(batch)],
+                [
+                    value
+                    for name, parent_id in batch
+                    for value in (name, parent_id, updated_at)
+                ],
+            )
+        ids = {
+            (name, parent_id): account_id
+            for account_id, name, parent_id in database.execute_sql(
+                "SELECT id, name, parent_id FROM account WHERE id > ?", (last_id,)
+            )
+        }
+        AccountClosure.add_many(last_id)
+        return ids
+
+
+class AccountClosure(Model):
+    """
+    The closure of the account tree, i.e. one row for each account and each of
+    its ancestors, at the depth the account is below the ancestor (including
+    the account itself at depth 0). Thereby the bookings of a subtree of any
+    depth can be aggregated with one indexed join.
+    """
+
+    ancestor = ForeignKeyField(Account, backref="+", on_delete="CASCADE")
+    descendant = ForeignKeyField(Account, backref="+", on_delete="CASCADE")
+    depth = IntegerField()
+
+    class Meta:
+        database = BaseModel._meta.database
+        primary_key = CompositeKey("ancestor", "descendant")
+
+    @classmethod
+    def add(cls, account_id, parent_id=None):
+        """
+        Adds a new account below its parent.
+        """
+        cls.insert(ancestor=account_id, descendant=account_id, depth=0).execute()
+        if parent_id is not None:
+            cls.insert_from(
+                cls.select(cls.ancestor, Value(account_id), cls.depth + 1).where(
+                    cls.descendant == parent_id
+                ),
+                fields=[cls.ancestor, cls.descendant, cls.depth],
+            ).execute()
+
+    @classmethod
+    def add_many(cls, last_id):
+        """
+        Adds the accounts above the id last_id, i.e. those created since, below
+        their parents, whose closure must be complete.
+        """
+        cls.insert_from(
+            Account.select(Account.id, Account.id, Value(0)).where(
+                Account.id > last_id
+            ),
+            fields=[cls.ancestor, cls.descendant, cls.depth],
+        ).execute()
+        cls.insert_from(
+            cls.select(cls.ancestor, Account.id, cls.depth + 1)
+            .join(Account, on=(Account.parent == cls.descendant))
+            .where(Account.id > last_id),
+            fields=[cls.ancestor, cls.descendant, cls.depth],
+        ).execute()
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Rebuilds the closure from the parents of all accounts.
+        """
+        with cls._meta.database.atomic():
+            cls.delete().execute()
+            cls._meta.database.execute_sql("""
+                INSERT INTO accountclosure (ancestor_id, descendant_id, depth)
+                WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+                    SELECT id, id, 0 FROM account
+                    UNION ALL
+                    SELECT tree.ancestor_id, account.id, tree.depth + 1
+                    FROM tree JOIN account ON account.parent_id = tree.descendant_id
+                )
+                SELECT ancestor_id, descendant_id, depth FROM tree
+                """)
+
 
 class Booking(BaseModel):
     """
@@ -106,6 +335,10 @@ class Booking(BaseModel):
     comment = CharField(null=True)
     value = DecimalField()
 
+    class Meta:
+        # Covers the sums of the bookings per account
+        indexes = ((("account", "journalentry", "value"), False),)
+
     def __str__(self):
         return (
             f"{self.account} | "
@@ -122,14 +355,638 @@ class VirtualBooking(BaseModel):
     """
 
     account = ForeignKeyField(Account, backref="account_entries")
-    date = DateField()
+    date = DateField(index=True)
     document = ForeignKeyField(Document, null=True, backref="journal_entries")
     comment = CharField(null=True)
     value = DecimalField()
+    # The id of the imported invoice, s.t. each invoice is imported once
+    invoice = CharField(null=True, unique=True)
+
+    class Meta:
+        # Covers the sums of the virtual bookings per account and date range
+        indexes = ((("account", "date", "value"), False),)
+
+
+class InvoiceCache(Model):
+    """
+    The values the InvoiceImporter read from an invoice file, s.t. unchanged
+    invoices are not parsed again. An entry is valid as long as the mtime (in
+    ns) of the file and the keys of the values are the same.
+    """
+
+    path = CharField(primary_key=True)
+    mtime = BigIntegerField()
+    keys = CharField()
+    invoice = CharField()
+    account = CharField()
+    value = DecimalField()
+    date = DateField()
+
+    class Meta:
+        database = BaseModel._meta.database
+
+
+class AccountBalance(Model):
+    """
+    The saldo of the bookings and of the virtual bookings of each account,
+    including all accounts below it. It is kept current by the triggers in
+    BALANCE_TRIGGERS, s.t. it can be read instead of summing the bookings.
+    """
+
+    account = ForeignKeyField(
+        Account, primary_key=True, backref="+", on_delete="CASCADE"
+    )
+    value = DecimalField(default=0)
+    virtual_value = DecimalField(default=0)
+
+    class Meta:
+        database = BaseModel._meta.database
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recomputes the balances (and the balances per month and the snapshots
+        of the closed periods) from all bookings. Returns the number of
+        accounts whose balance was not consistent.
+        """
+        database = cls._meta.database
+        with database.atomic():
+            before = cls.rounded()
+            cls.delete().execute()
+            AccountMonthBalance.delete().execute()
+            database.execute_sql("""
+                INSERT INTO accountmonthbalance (account_id, month, value, virtual_value)
+                SELECT ancestor_id, month, SUM(value), SUM(virtual_value) FROM (
+                    SELECT accountclosure.ancestor_id,
+                           date(journalentry.date, 'start of month') AS month,
+                           booking.value AS value,
+                           0 AS virtual_value
+                    FROM booking
+                    JOIN journalentry ON journalentry.id = booking.journalentry_id
+                    JOIN accountclosure
+                        ON accountclosure.descendant_id = booking.account_id
+                    UNION ALL
+                    SELECT accountclosure.ancestor_id,
+                           date(virtualbooking.date, 'start of month'),
+                           0,
+                           virtualbooking.value
+                    FROM virtualbooking
+                    JOIN accountclosure
+                        ON accountclosure.descendant_id = virtualbooking.account_id
+                )
+                GROUP BY ancestor_id, month
+                """)
+            database.execute_sql("""
+                INSERT INTO accountbalance (account_id, value, virtual_value)
+                SELECT account_id, SUM(value), SUM(virtual_value)
+                FROM accountmonthbalance GROUP BY account_id
+                """)
+            for period in ClosedPeriod.select():
+                period.take_snapshot()
+            after = cls.rounded()
+        return len({balance[0] for balance in before ^ after})
+
+    @classmethod
+    def rounded(cls):
+        """
+        Returns all balances rounded to cents as set of tuples.
+        """
+        return {
+            (account_id, round(value, 2), round(virtual_value, 2))
+            for account_id, value, virtual_value in cls.select(
+                cls.account, cls.value, cls.virtual_value
+            ).tuples()
+        }
+
+
+class AccountMonthBalance(Model):
+    """
+    The saldo per month of each account, like AccountBalance. The month is
+    stored as its first day.
+    """
+
+    account = ForeignKeyField(Account, backref="+", on_delete="CASCADE")
+    month = DateField()
+    value = DecimalField(default=0)
+    virtual_value = DecimalField(default=0)
+
+    class Meta:
+        database = BaseModel._meta.database
+        primary_key = CompositeKey("account", "month")
+
+
+BALANCE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS booking_balance_insert
+    AFTER INSERT ON booking BEGIN
+        INSERT INTO accountbalance (account_id, value, virtual_value)
+        SELECT ancestor_id, new.value, 0
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id) DO UPDATE SET value = value + excluded.value;
+        INSERT INTO accountmonthbalance (account_id, month, value, virtual_value)
+        SELECT ancestor_id, (
+            SELECT date(date, 'start of month') FROM journalentry
+            WHERE id = new.journalentry_id
+        ), new.value, 0
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id, month) DO UPDATE SET value = value + excluded.value;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS booking_balance_delete
+    AFTER DELETE ON booking BEGIN
+        UPDATE accountbalance SET value = value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        );
+        UPDATE accountmonthbalance SET value = value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND month = (
+            SELECT date(date, 'start of month') FROM journalentry
+            WHERE id = old.journalentry_id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS booking_balance_update
+    AFTER UPDATE OF value, account_id, journalentry_id ON booking BEGIN
+        UPDATE accountbalance SET value = value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        );
+        UPDATE accountmonthbalance SET value = value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND month = (
+            SELECT date(date, 'start of month') FROM journalentry
+            WHERE id = old.journalentry_id
+        );
+        INSERT INTO accountbalance (account_id, value, virtual_value)
+        SELECT ancestor_id, new.value, 0
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id) DO UPDATE SET value = value + excluded.value;
+        INSERT INTO accountmonthbalance (account_id, month, value, virtual_value)
+        SELECT ancestor_id, (
+            SELECT date(date, 'start of month') FROM journalentry
+            WHERE id = new.journalentry_id
+        ), new.value, 0
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id, month) DO UPDATE SET value = value + excluded.value;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS virtualbooking_balance_insert
+    AFTER INSERT ON virtualbooking BEGIN
+        INSERT INTO accountbalance (account_id, value, virtual_value)
+        SELECT ancestor_id, 0, new.value
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id) DO UPDATE
+        SET virtual_value = virtual_value + excluded.virtual_value;
+        INSERT INTO accountmonthbalance (account_id, month, value, virtual_value)
+        SELECT ancestor_id, date(new.date, 'start of month'), 0, new.value
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id, month) DO UPDATE
+        SET virtual_value = virtual_value + excluded.virtual_value;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS virtualbooking_balance_delete
+    AFTER DELETE ON virtualbooking BEGIN
+        UPDATE accountbalance SET virtual_value = virtual_value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        );
+        UPDATE accountmonthbalance SET virtual_value = virtual_value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND month = date(old.date, 'start of month');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS virtualbooking_balance_update
+    AFTER UPDATE OF value, account_id, date ON virtualbooking BEGIN
+        UPDATE accountbalance SET virtual_value = virtual_value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        );
+        UPDATE accountmonthbalance SET virtual_value = virtual_value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND month = date(old.date, 'start of month');
+        INSERT INTO accountbalance (account_id, value, virtual_value)
+        SELECT ancestor_id, 0, new.value
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id) DO UPDATE
+        SET virtual_value = virtual_value + excluded.virtual_value;
+        INSERT INTO accountmonthbalance (account_id, month, value, virtual_value)
+        SELECT ancestor_id, date(new.date, 'start of month'), 0, new.value
+        FROM accountclosure WHERE descendant_id = new.account_id
+        ON CONFLICT (account_id, month) DO UPDATE
+        SET virtual_value = virtual_value + excluded.virtual_value;
+    END
+    """,
+)
+
+
+UNBALANCED_STATUSES = ("unbooked", "partial", "overbooked")
+
+BOOKED_STATUS = """
+    CASE
+        WHEN round(booked, 2) = round(abs(value), 2) THEN 'booked'
+        WHEN round(booked, 2) = 0 THEN 'unbooked'
+        WHEN round(booked, 2) < round(abs(value), 2) THEN 'partial'
+        ELSE 'overbooked'
+    END
+"""
+
+BOOKED_TRIGGERS = (
+    # Entries without value have nothing to book, they start as booked
+    f"""
+    CREATE TRIGGER IF NOT EXISTS journalentry_booked_insert
+    AFTER INSERT ON journalentry WHEN round(new.value, 2) = 0 BEGIN
+        UPDATE journalentry SET status = {BOOKED_STATUS}
+        WHERE id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS booking_booked_insert
+    AFTER INSERT ON booking BEGIN
+        UPDATE journalentry SET booked = booked + new.value
+        WHERE id = new.journalentry_id;
+        UPDATE journalentry SET status = {BOOKED_STATUS}
+        WHERE id = new.journalentry_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS booking_booked_delete
+    AFTER DELETE ON booking BEGIN
+        UPDATE journalentry SET booked = booked - old.value
+        WHERE id = old.journalentry_id;
+        UPDATE journalentry SET status = {BOOKED_STATUS}
+        WHERE id = old.journalentry_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS booking_booked_update
+    AFTER UPDATE OF value, journalentry_id ON booking BEGIN
+        UPDATE journalentry SET booked = booked - old.value
+        WHERE id = old.journalentry_id;
+        UPDATE journalentry SET booked = booked + new.value
+        WHERE id = new.journalentry_id;
+        UPDATE journalentry SET status = {BOOKED_STATUS}
+        WHERE id IN (old.journalentry_id, new.journalentry_id);
+    END
+    """,
+)
+
+
+class ClosedPeriod(BaseModel):
+    """
+    A closed fiscal period. The closing balances of all accounts are kept in
+    BalanceSnapshot. Bookings dated within a locked period are refused by the
+    triggers in LOCK_TRIGGERS.
+    """
+
+    name = CharField(unique=True)
+    start_date = DateField()
+    end_date = DateField(index=True)
+    locked = BooleanField(default=False)
+
+    @classmethod
+    def locking(cls, date):
+        """
+        Returns the expression whether date (a field) lies within a locked
+        period, as checked by the triggers in LOCK_TRIGGERS.
+        """
+        return fn.EXISTS(
+            cls.select(cls.id).where(
+                cls.locked & date.between(cls.start_date, cls.end_date)
+            )
+        )
+
+    @classmethod
+    def locked_ranges(cls):
+        """
+        Returns the start and end dates of the locked periods.
+        """
+        return list(cls.select(cls.start_date, cls.end_date).where(cls.locked).tuples())
+
+    @classmethod
+    def latest(cls, end_date):
+        """
+        Returns the last period that ends on or before end_date (or None).
+        """
+        return (
+            cls.select()
+            .where(cls.end_date <= end_date)
+            .order_by(cls.end_date.desc())
+            .first()
+        )
+
+    def take_snapshot(self):
+        """
+        Stores the balances of all accounts at the end of this period, summed
+        from the AccountMonthBalance. Returns the number of accounts.
+        """
+        database = self._meta.database
+        with database.atomic():
+            BalanceSnapshot.delete().where(BalanceSnapshot.period == self).execute()
+            query = BalanceSnapshot.insert_from(
+                AccountMonthBalance.select(
+                    Value(self.id),
+                    AccountMonthBalance.account,
+                    fn.SUM(AccountMonthBalance.value),
+                    fn.SUM(AccountMonthBalance.virtual_value),
+                )
+                .where(AccountMonthBalance.month <= self.end_date)
+                .group_by(AccountMonthBalance.account),
+                [
+                    BalanceSnapshot.period,
+                    BalanceSnapshot.account,
+                    BalanceSnapshot.value,
+                    BalanceSnapshot.virtual_value,
+                ],
+            )
+            return database.execute(query).rowcount
+
+
+class BalanceSnapshot(Model):
+    """
+    The balances of each account at the end of a closed period, including all
+    bookings before it. Bookings that are changed later on are added by the
+    triggers in SNAPSHOT_TRIGGERS.
+    """
+
+    period = ForeignKeyField(ClosedPeriod, backref="snapshots", on_delete="CASCADE")
+    account = ForeignKeyField(Account, backref="+", on_delete="CASCADE")
+    value = DecimalField(default=0)
+    virtual_value = DecimalField(default=0)
+
+    class Meta:
+        database = BaseModel._meta.database
+        primary_key = CompositeKey("period", "account")
+
+
+SNAPSHOT_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS booking_snapshot_insert
+    AFTER INSERT ON booking BEGIN
+        INSERT INTO balancesnapshot (period_id, account_id, value, virtual_value)
+        SELECT closedperiod.id, ancestor_id, new.value, 0
+        FROM closedperiod JOIN accountclosure ON descendant_id = new.account_id
+        WHERE end_date >= (
+            SELECT date FROM journalentry WHERE id = new.journalentry_id
+        )
+        ON CONFLICT (period_id, account_id) DO UPDATE
+        SET value = value + excluded.value;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS booking_snapshot_delete
+    AFTER DELETE ON booking BEGIN
+        UPDATE balancesnapshot SET value = value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND period_id IN (
+            SELECT id FROM closedperiod WHERE end_date >= (
+                SELECT date FROM journalentry WHERE id = old.journalentry_id
+            )
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS booking_snapshot_update
+    AFTER UPDATE OF value, account_id, journalentry_id ON booking BEGIN
+        UPDATE balancesnapshot SET value = value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND period_id IN (
+            SELECT id FROM closedperiod WHERE end_date >= (
+                SELECT date FROM journalentry WHERE id = old.journalentry_id
+            )
+        );
+        INSERT INTO balancesnapshot (period_id, account_id, value, virtual_value)
+        SELECT closedperiod.id, ancestor_id, new.value, 0
+        FROM closedperiod JOIN accountclosure ON descendant_id = new.account_id
+        WHERE end_date >= (
+            SELECT date FROM journalentry WHERE id = new.journalentry_id
+        )
+        ON CONFLICT (period_id, account_id) DO UPDATE
+        SET value = value + excluded.value;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS virtualbooking_snapshot_insert
+    AFTER INSERT ON virtualbooking BEGIN
+        INSERT INTO balancesnapshot (period_id, account_id, value, virtual_value)
+        SELECT closedperiod.id, ancestor_id, 0, new.value
+        FROM closedperiod JOIN accountclosure ON descendant_id = new.account_id
+        WHERE end_date >= new.date
+        ON CONFLICT (period_id, account_id) DO UPDATE
+        SET virtual_value = virtual_value + excluded.virtual_value;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS virtualbooking_snapshot_delete
+    AFTER DELETE ON virtualbooking BEGIN
+        UPDATE balancesnapshot SET virtual_value = virtual_value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND period_id IN (SELECT id FROM closedperiod WHERE end_date >= old.date);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS virtualbooking_snapshot_update
+    AFTER UPDATE OF value, account_id, date ON virtualbooking BEGIN
+        UPDATE balancesnapshot SET virtual_value = virtual_value - old.value
+        WHERE account_id IN (
+            SELECT ancestor_id FROM accountclosure WHERE descendant_id = old.account_id
+        ) AND period_id IN (SELECT id FROM closedperiod WHERE end_date >= old.date);
+        INSERT INTO balancesnapshot (period_id, account_id, value, virtual_value)
+        SELECT closedperiod.id, ancestor_id, 0, new.value
+        FROM closedperiod JOIN accountclosure ON descendant_id = new.account_id
+        WHERE end_date >= new.date
+        ON CONFLICT (period_id, account_id) DO UPDATE
+        SET virtual_value = virtual_value + excluded.virtual_value;
+    END
+    """,
+)
+
+
+def lock_trigger(table, event, date, rows):
+    """
+    Returns the trigger that refuses the event on table, if the date of one
+    of the rows (old and/or new) lies within a locked period.
+    """
+    in_period = " OR ".join(
+        f"{date.format(row=row)} BETWEEN start_date AND end_date" for row in rows
+    )
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_lock_{event.lower()}
+    BEFORE {event} ON {table}
+    WHEN EXISTS (SELECT 1 FROM closedperiod WHERE locked AND ({in_period}))
+    BEGIN
+        SELECT RAISE(ABORT, 'The booking date lies within a locked period.');
+    END
+    """
+
+
+LOCK_TRIGGERS = tuple(
+    lock_trigger(table, event, date, rows)
+    for table, date in (
+        ("booking", "(SELECT date FROM journalentry WHERE id = {row}.journalentry_id)"),
+        ("virtualbooking", "{row}.date"),
+    )
+    for event, rows in (
+        ("INSERT", ("new",)),
+        ("UPDATE", ("old", "new")),
+        ("DELETE", ("old",)),
+    )
+)
+
+
+class BaseIndex(FTS5Model):
+    """
+    Full-text indexes live in the same database as the models.
+    """
+
+    rowid = RowIDField()
+
+    class Meta:
+        database = BaseModel._meta.database
+
+
+class JournalEntryIndex(BaseIndex):
+    """
+    Full-text index of sender, receiver and subject of the journal entries.
+    The text is read from the journalentry table, the index is kept in sync
+    by the triggers in SEARCH_INDEX_TRIGGERS.
+    """
+
+    sender = SearchField()
+    receiver = SearchField()
+    subject = SearchField()
+
+    class Meta:
+        options = {"content": "journalentry", "content_rowid": "id"}
+
+
+class DocumentIndex(BaseIndex):
+    """
+    Full-text index of the extracted text of the documents. The rowid is the
+    id of the DocumentContent, the index is filled by the DocumentImporter.
+    It stores no copy of the text: the text is read, decompressed, from the
+    view DOCUMENT_TEXT_VIEW.
+    """
+
+    content = SearchField()
+
+    class Meta:
+        options = {"content": "documenttext", "content_rowid": "id"}
+
+
+DOCUMENT_TEXT_VIEW = """
+    CREATE VIEW IF NOT EXISTS documenttext AS
+    SELECT id, decompress(text) AS content FROM documentcontent
+    """
+
+
+SEARCH_INDEX_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS journalentry_index_insert
+    AFTER INSERT ON journalentry BEGIN
+        INSERT INTO journalentryindex (rowid, sender, receiver, subject)
+        VALUES (new.id, new.sender, new.receiver, new.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS journalentry_index_delete
+    AFTER DELETE ON journalentry BEGIN
+        INSERT INTO journalentryindex (journalentryindex, rowid, sender, receiver, subject)
+        VALUES ('delete', old.id, old.sender, old.receiver, old.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS journalentry_index_update
+    AFTER UPDATE OF sender, receiver, subject ON journalentry BEGIN
+        INSERT INTO journalentryindex (journalentryindex, rowid, sender, receiver, subject)
+        VALUES ('delete', old.id, old.sender, old.receiver, old.subject);
+        INSERT INTO journalentryindex (rowid, sender, receiver, subject)
+        VALUES (new.id, new.sender, new.receiver, new.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS documentcontent_index_delete
+    AFTER DELETE ON documentcontent BEGIN
+        INSERT INTO documentindex (documentindex, rowid, content)
+        VALUES ('delete', old.id, decompress(old.text));
+    END
+    """,
+)
+
+# The content of a hash is deleted with the last document of the hash
+DOCUMENT_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS document_content_delete
+    AFTER DELETE ON document
+    WHEN NOT EXISTS (SELECT 1 FROM document WHERE hash = old.hash) BEGIN
+        DELETE FROM documentcontent WHERE hash = old.hash;
+    END
+    """,
+)
+
+
+def create_search_index():
+    """
+    Creates the full-text indexes and their triggers. If the indexes are
+    new, the existing journal entries and documents are indexed.
+    """
+    database = BaseModel._meta.database
+    journal_indexed = JournalEntryIndex.table_exists()
+    documents_indexed = DocumentIndex.table_exists()
+    with database.atomic():
+        database.execute_sql(DOCUMENT_TEXT_VIEW)
+        database.create_tables([JournalEntryIndex, DocumentIndex])
+        for trigger in SEARCH_INDEX_TRIGGERS:
+            database.execute_sql(trigger)
+        if not journal_indexed:
+            JournalEntryIndex.rebuild()
+        if not documents_indexed:
+            DocumentIndex.rebuild()
 
 
 def create_tables():
-    with get_db() as database:
+    closure_exists = AccountClosure.table_exists()
+    balances_exist = AccountBalance.table_exists()
+    database = get_db()
+    with database.atomic():
         database.create_tables(
-            [Document, JournalEntry, Account, Booking, VirtualBooking]
+            [
+                Document,
+                DocumentContent,
+                JournalEntry,
+                Account,
+                AccountClosure,
+                Booking,
+                VirtualBooking,
+                InvoiceCache,
+                AccountBalance,
+                AccountMonthBalance,
+                ClosedPeriod,
+                BalanceSnapshot,
+            ]
         )
+    for trigger in (
+        BALANCE_TRIGGERS
+        + SNAPSHOT_TRIGGERS
+        + LOCK_TRIGGERS
+        + BOOKED_TRIGGERS
+        + DOCUMENT_TRIGGERS
+    ):
+        database.execute_sql(trigger)
+    if not closure_exists:
+        AccountClosure.rebuild()
+    if not balances_exist:
+        AccountBalance.rebuild()
+    create_search_index()
@@ -0,0 +1,164 @@
+"""
+Parsers read the CSV exports of banks. Every bank has a parser in
+BANK_PARSERS, which recognizes its exports by their header and converts
+their rows to sanitized rows or straight to journal entries.
+
+Reversing the rows of an export holds at most REVERSE_CHUNK_ROWS rows in
+memory, the reversed chunks are spilled to a temporary file (on disk, once
+it exceeds SPILL_SIZE bytes).
+"""
+import csv
+import io
+import tempfile
+
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+
+DECIMAL_QUANTIZATION = ".01"
+CSV_FORMAT = {"quotechar": '"', "delimiter": ";", "quoting": csv.QUOTE_MINIMAL}
+HEADER_ROWS = 20
+REVERSE_CHUNK_ROWS = 100_000
+SPILL_SIZE = 64 * 1024 * 1024
+
+# German amounts, e.g. "-1.234,56 €": drop thousands separators, currency
+# sign (€ is \x80 in the latin3 decoded exports) and blanks, use a decimal point
+AMOUNT_TRANSLATION = str.maketrans(
+    {".": None, ",": ".", "\x80": None, "€": None, " ": None, "\xa0": None}
+)
+
+
+class CsvHeaderError(Exception):
+    pass
+
+
+class BankCsvParser:
+    """
+    Base class of the bank parsers. The rows of an export are the rows
+    after its header, if the header is found within the first HEADER_ROWS
+    rows, i.e. exports with a preamble or without header are read as well.
+    """
+
+    name = None
+    encoding = "utf-8"
+    expected_header = []
+
+    def header_ok(self, header):
+        if header != self.expected_header:
+            return False
+        return True
+
+    def has_header(self, path):
+        """
+        Returns whether the header is found in the export at path.
+        """
+        with open(path, encoding=self.encoding, errors="replace", newline="") as f:
+            reader = csv.reader(f, **CSV_FORMAT)
+            return any(self.header_ok(row) for row in islice(reader, HEADER_ROWS))
+
+    def iter_rows(self, csv_file):
+        """
+        Yields the rows of the export after the header.
+        """
+        reader = csv.reader(csv_file, **CSV_FORMAT)
+        head = list(islice(reader, HEADER_ROWS))
+        for n, row in enumerate(head):
+            if self.header_ok(row):
+                del head[: n + 1]
+                break
+        yield from head
+        yield from reader
+
+    def get_entry(self, row):
+        """
+        Returns the row in the sanitized format: date (D.M.YYYY), sender,
+        receiver, subject, value and balance.
+        """
+        raise NotImplementedError
+
+    def get_journal_entry(self, row):
+        """
+        Returns the row as parsed by JournalImporter._parse_row.
+        """
+        entry = self.get_entry(row)
+        day, month, year = entry[0].split(".")
+        return (date(int(year), int(month), int(day)), *entry[1:])
+
+
+class PostBankCsvParser(BankCsvParser):
+
+    name = "postbank"
+    encoding = "latin3"
+    expected_header = [
+        "Buchungsdatum",
+        "Wertstellung",
+        "Umsatzart",
+        "Buchungsdetails",
+        "Auftraggeber",
+        "Empfänger",
+        "Betrag (\x80)",
+        "Saldo (\x80)",
+    ]
+
+    def __init__(self, q=DECIMAL_QUANTIZATION):
+        self.q = Decimal(q)
+
+    def amount_to_decimal(self, value):
+        """
+        Returns the German formatted amount as Decimal, without a detour via
+        float and independent of the installed locales.
+        """
+        return Decimal(value.translate(AMOUNT_TRANSLATION)).quantize(self.q)
+
+    def sanitize_subject(self, subject):
+        return subject.replace("Referenz NOTPROVIDED", "").replace(
+            "Verwendungszweck", ""
+        )
+
+    def get_entry(self, row):
+        return [
+            row[0],
+            row[4],
+            row[5],
+            self.sanitize_subject(row[3]),
+            self.amount_to_decimal(row[6]),
+            self.amount_to_decimal(row[7]),
+        ]
+
+
+BANK_PARSERS = {parser.name: parser for parser in (PostBankCsvParser,)}
+
+
+def detect_parser(path):
+    """
+    Returns a parser for the export at path, of the bank whose header is found
+    in it.
+    """
+    for parser_class in BANK_PARSERS.values():
+        parser = parser_class()
+        if parser.has_header(path):
+            return parser
+    raise CsvHeaderError(f"The bank of {path} is unknown, please give --bank.")
+
+
+def iter_reversed(rows, chunk_rows=REVERSE_CHUNK_ROWS):
+    """
+    Yields the rows (lists of strings) in reverse order, with bounded
+    memory. The rows are read in chunks of chunk_rows, each chunk is written
+    reversed to a spill file. Then the chunks are read back, the last first.
+    """
+    rows = iter(rows)
+    offsets = [0]
+    with tempfile.SpooledTemporaryFile(max_size=SPILL_SIZE) as spill:
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                break
+            buffer = io.StringIO()
+            csv.writer(buffer, **CSV_FORMAT).writerows(reversed(chunk))
+            spill.write(buffer.getvalue().encode())
+            offsets.append(spill.tell())
+        for start, end in reversed(list(zip(offsets, offsets[1:]))):
+            spill.seek(start)
+            text = spill.read(end - start).decode()
+            yield from csv.reader(io.StringIO(text, newline=""), **CSV_FORMAT)
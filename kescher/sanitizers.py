@@ -3,67 +3,26 @@
 This script sanitizes CSV files downloaded from Postbank (Germany).
 It strips useless characters, and converts the numbers to a reasonable
 and usable format.
+
+The rows are streamed from the input to the output file, see
+kescher.parsers.
 """
 import click
 import csv
-import locale
 import logging
 
-from decimal import Decimal
 from kescher.logging import setup_logging
+from kescher.parsers import (
+    CSV_FORMAT,
+    DECIMAL_QUANTIZATION,
+    PostBankCsvParser,
+    iter_reversed,
+)
 from pathlib import Path
 
-LOCALE = "de_DE.UTF-8"
-DECIMAL_QUANTIZATION = ".01"
-
 logger = setup_logging(Path.cwd())
 
 
-class PostBankCsvParser:
-
-    expected_header = [
-        "Buchungsdatum",
-        "Wertstellung",
-        "Umsatzart",
-        "Buchungsdetails",
-        "Auftraggeber",
-        "Empfänger",
-        "Betrag (\x80)",
-        "Saldo (\x80)",
-    ]
-
-    def __init__(self, q):
-        self.q = q
-
-    def header_ok(self, header):
-        if header != self.expected_header:
-            return False
-        return True
-
-    def amount_to_decimal(self, value):
-        value = value.replace("\x80", "")
-        return Decimal.from_float(locale.atof(value)).quantize(Decimal(self.q))
-
-    def sanitize_subject(self, subject):
-        return subject.replace("Referenz NOTPROVIDED", "").replace(
-            "Verwendungszweck", ""
-        )
-
-    def get_entry(self, row):
-        return [
-            row[0],
-            row[4],
-            row[5],
-            self.sanitize_subject(row[3]),
-            self.amount_to_decimal(row[6]),
-            self.amount_to_decimal(row[7]),
-        ]
-
-
-class CsvHeaderError(Exception):
-    pass
-
-
 @click.command()
 @click.option("--debug", is_flag=True, default=False, help="Debug logging")
 @click.option("--reverse", is_flag=True, default=False, help="Reverse order of rows")
@@ -80,19 +39,16 @@ def sanitize_postbank(debug, reverse, infile, outfile):
     logger.debug(f"Infile for Postbank Sanitation: {infile.name}")
     logger.debug(f"Outfile for Postbank Sanitation: {outfile.name}")
     pb_csv_parser = PostBankCsvParser(DECIMAL_QUANTIZATION)
-    locale.setlocale(locale.LC_ALL, LOCALE)
-    reader = csv.reader(infile, quotechar='"', delimiter=";")
-    writer = csv.writer(
-        outfile, quotechar='"', delimiter=";", quoting=csv.QUOTE_MINIMAL
-    )
-
-    rows = []
-    for row in reader:
-        rows.append(pb_csv_parser.get_entry(row))
-        logger.debug(f"Reading row: {', '.join(row)}")
-
+    reader = pb_csv_parser.iter_rows(infile)
+    if logger.isEnabledFor(logging.DEBUG):
+        reader = log_rows(reader)
     if reverse:
-        rows.reverse()
-        logger.debug(f"Reversing result, beause reverse is True")
+        logger.debug("Reversing result, because reverse is True")
+        reader = iter_reversed(reader)
+    csv.writer(outfile, **CSV_FORMAT).writerows(map(pb_csv_parser.get_entry, reader))
+
 
-    writer.writerows(rows)
+def log_rows(rows):
+    for row in rows:
+        logger.debug("Reading row: %s", ", ".join(row))
+        yield row
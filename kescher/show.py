@@ -1,22 +1,42 @@
 import sys
 
-from kescher.booking import get_account_saldo
+from collections import defaultdict
+from decimal import Decimal
+from kescher.booking import get_saldos
 from kescher.helpers import Box
 from kescher.models import Account
 
 
-def show_accounts(parent=None, layer=0):
+def show_accounts(depth=None, start_date=None, end_date=None):
     """
-    Show the account tree.
+    Show the account tree (down to the given depth). Yields layer, name,
+    saldo and virtual saldo of each account, in tree order.
+
+    The saldos of all accounts (including the accounts below them) are read
+    with get_saldos at once.
     """
-    if not parent:
-        accounts = Account.select().where(Account.parent.is_null())
-    else:
-        accounts = Account.select().where(Account.parent == parent)
-    for account in accounts:
-        saldo, virtual_saldo = get_account_saldo(account.name, with_virtual=True)
-        yield (layer, account.name, saldo, virtual_saldo)
-        yield from show_accounts(parent=account, layer=layer + 1)
+    names = {}
+    children = defaultdict(list)
+    for acc_id, name, parent_id in (
+        Account.select(Account.id, Account.name, Account.parent)
+        .order_by(Account.id)
+        .tuples()
+    ):
+        names[acc_id] = name
+        children[parent_id].append(acc_id)
+
+    saldos = get_saldos(None, start_date, end_date)
+    zero = (Decimal("0.00"), Decimal("0.00"))
+
+    # Accounts in tree order (parents before their children) with their layer
+    stack = [(acc_id, 0) for acc_id in reversed(children[None])]
+    while stack:
+        acc_id, layer = stack.pop()
+        if depth is None or layer <= depth:
+            yield (layer, names[acc_id], *saldos.get(acc_id, zero))
+            stack.extend(
+                (child_id, layer + 1) for child_id in reversed(children[acc_id])
+            )
 
 
 def show_table(filter_fct, filter_, width):
@@ -0,0 +1,177 @@
+"""
+Statistics on where the time of a command goes: the SQL statements executed
+by the database and the stages of the importers (parse, hash, extract and
+insert). Nothing is recorded, unless a collection is active, e.g. when
+kescher is called with --stats.
+"""
+import re
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+N_PLUS_ONE_THRESHOLD = 20
+TOP_STATEMENTS = 10
+
+PLACEHOLDERS = re.compile(r"\?(?:, \?)+")
+VALUES = re.compile(r"(\([^()]*\))(?:, \1)+")
+
+_stats = None
+
+
+class Stats:
+    """
+    Counts and times SQL statements by their shape (i.e. the statement with
+    lists of placeholders collapsed) and the stages of a command.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = defaultdict(lambda: [0, 0.0])
+        self.stages = defaultdict(lambda: [0, 0.0])
+
+    def add_statement(self, sql, seconds):
+        statement = self.statements[normalize(sql)]
+        statement[0] += 1
+        statement[1] += seconds
+
+    def add_stage(self, name, seconds, count=1):
+        stage = self.stages[name]
+        stage[0] += count
+        stage[1] += seconds
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of iterable, the time spent producing each of them
+        is added to the stage name.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage(name, time.perf_counter() - start, 0)
+                return
+            self.add_stage(name, time.perf_counter() - start)
+            yield item
+
+    def n_plus_one(self):
+        """
+        Returns the SELECT statements, which were executed at least
+        N_PLUS_ONE_THRESHOLD times, i.e. probably once per row of another query.
+        """
+        return [
+            sql
+            for sql, (count, _) in self.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD and sql.startswith("SELECT")
+        ]
+
+    def summary(self):
+        """
+        Returns the statistics as dict, with the statements sorted by the time
+        spent executing them.
+        """
+        statements = sorted(
+            self.statements.items(), key=lambda item: item[1][1], reverse=True
+        )
+        return {
+            "seconds": round(time.perf_counter() - self.start, 4),
+            "queries": {
+                "count": sum(count for count, _ in self.statements.values()),
+                "seconds": round(sum(s for _, s in self.statements.values()), 4),
+                "statements": [
+                    {"sql": sql, "count": count, "seconds": round(seconds, 4)}
+                    for sql, (count, seconds) in statements
+                ],
+            },
+            "n_plus_one": self.n_plus_one(),
+            "stages": {
+                name: {"count": count, "seconds": round(seconds, 4)}
+                for name, (count, seconds) in self.stages.items()
+            },
+        }
+
+
+def normalize(sql):
+    """
+    Returns the shape of the statement: lists of placeholders (IN ...) and
+    of value tuples (bulk inserts) are collapsed, s.t. they are counted as
+    one statement regardless of their length.
+    """
+    return VALUES.sub(r"\1, ...", PLACEHOLDERS.sub("?, ...", sql))
+
+
+def get_stats():
+    """
+    Returns the active Stats or None.
+    """
+    return _stats
+
+
+@contextmanager
+def collect():
+    """
+    Collects the statistics of the statements and stages run in the block.
+    """
+    global _stats
+    previous = _stats
+    _stats = Stats()
+    try:
+        yield _stats
+    finally:
+        _stats = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    Adds the time spent in the block to the stage name.
+    """
+    if _stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stats.add_stage(name, time.perf_counter() - start)
+
+
+def add_stage(name, seconds):
+    if _stats is not None:
+        _stats.add_stage(name, seconds)
+
+
+def timed(name, iterable):
+    """
+    Returns iterable. While collecting, the time spent producing its items is
+    added to the stage name.
+    """
+    if _stats is None:
+        return iterable
+    return _stats.timed(name, iterable)
+
+
+def format_summary(summary):
+    """
+    Returns the lines of a human readable summary.
+    """
+    queries = summary["queries"]
+    lines = [
+        f"{queries['count']} SQL statements in {queries['seconds']:.3f}s "
+        + f"of {summary['seconds']:.3f}s total."
+    ]
+    for statement in queries["statements"][:TOP_STATEMENTS]:
+        flag = " (N+1?)" if statement["sql"] in summary["n_plus_one"] else ""
+        lines.append(
+            f"{statement['count']:>8}x {statement['seconds']:8.3f}s  "
+            + f"{statement['sql'][:100]}{flag}"
+        )
+    for name, stage_stats in summary["stages"].items():
+        lines.append(
+            f"Stage {name}: {stage_stats['count']}x in {stage_stats['seconds']:.3f}s"
+        )
+    for sql in summary["n_plus_one"]:
+        lines.append(f"Possible N+1 pattern: {sql[:100]}")
+    return lines
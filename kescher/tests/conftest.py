@@ -2,11 +2,11 @@ import pytest
 
 
 EXPECTED_ACCOUNTS = (
-    "┣━Debitoren \x1b[32m0.00",
-    "┃ ┣━1000 \x1b[31m-240.00",
+    "┣━Debitoren \x1b[31m-120.00",
+    "┃ ┣━1000 \x1b[31m-120.00",
     "┃ ┣━1001 \x1b[32m0.00",
     "┃ ┣━1002 \x1b[32m0.00",
-    "┣━Umsatzsteuer \x1b[32m48.0",
+    "┣━Umsatzsteuer \x1b[32m48.00",
     "┃ ┣━USt_Einnahmen \x1b[32m18.52",
     "┃ ┣━USt_Ausgaben \x1b[32m29.48",
     "┣━Aufwendungen \x1b[32m0.00",
@@ -20,7 +20,7 @@ EXPECTED_ACCOUNTS = (
     "┃ ┃ ┣━Verbrauchsmaterialien \x1b[32m0.00",
     "┣━Erträge \x1b[32m0.00",
     "┃ ┣━Internetanschlüsse \x1b[32m0.00",
-    "┣━1003 \x1b[31m-576.00",
+    "┣━1003 \x1b[31m-288.00",
 )
 
 
@@ -2,11 +2,31 @@
 This module contains the tests for cli commands. It asserts that the
 command line interface works as intended.
 """
+import json
+import os
+import subprocess
+import sys
 import yaml
 
 from click.testing import CliRunner
-from kescher.models import Account, Document, JournalEntry, VirtualBooking
+from decimal import Decimal
+from kescher.benchmarks import benchmark_database
+from kescher.models import (
+    Account,
+    AccountBalance,
+    AccountClosure,
+    Booking,
+    Document,
+    DocumentContent,
+    InvoiceCache,
+    JournalEntry,
+    VirtualBooking,
+    create_tables,
+)
+from kescher import importers
 from kescher.cli import cli
+from kescher.generators import make_pdf
+from kescher.sanitizers import sanitize_postbank
 from pathlib import Path
 
 KESCHER_DB = "kescher.db"
@@ -17,6 +37,10 @@ ACCOUNTS_FILE = FIXTURES_PATH / "accounts.yaml"
 JOURNAL_FILE = FIXTURES_PATH / "journal.csv"
 INVOICES_FLAT = FIXTURES_PATH / "invoices_flat"
 INVOICES_NESTED = FIXTURES_PATH / "invoices_nested"
+DOCUMENTS = FIXTURES_PATH / "documents"
+POSTBANK_STATEMENT = (
+    FIXTURES_PATH / "sanitizers/Umsatzauskunft_KtoNr01234567890_03-01-2020_17-18-19.csv"
+)
 
 DOC_HASHES = {
     "1000.2019.Q3.pdf": "254e330461e4a64a4243ff7899ab67a8daf069a1b6fc738d4db1c768df4d26a7",
@@ -71,6 +95,20 @@ def test_import_accounts():
         assert Account.get_or_none(Account.name == account) is not None
 
 
+def test_import_accounts_again():
+    """
+    Asserts that importing the accounts again leaves them unchanged.
+    """
+    n_accounts = Account.select().count()
+    n_closure = AccountClosure.select().count()
+    runner = CliRunner()
+    result = runner.invoke(cli, ["import", "accounts", str(ACCOUNTS_FILE)])
+    assert result.exit_code == 0
+    assert "0 accounts added, 18 unchanged, 0 orphaned." in result.output
+    assert Account.select().count() == n_accounts
+    assert AccountClosure.select().count() == n_closure
+
+
 def iterate_accounts(accounts):
     """
     Helper function to iterate to ease iterating through the accounts.
@@ -98,6 +136,26 @@ def test_import_journal():
     output_string = "Importing CSV journal kescher/tests/fixtures/journal.csv..."
     assert output_string in result.output
     assert len(JournalEntry.select()) == 6
+    # All entries of one import share the import date, updated_at is stamped on write
+    assert JournalEntry.select(JournalEntry.imported_at).distinct().count() == 1
+    assert not JournalEntry.select().where(JournalEntry.updated_at.is_null()).exists()
+
+
+def test_import_journal_again():
+    """
+    Asserts that importing the same journal again does not duplicate entries.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ["import", "journal", str(JOURNAL_FILE)])
+    assert result.exit_code == 0
+    assert "0 new entries, 6 duplicates skipped." in result.output
+    assert len(JournalEntry.select()) == 6
+    result = runner.invoke(
+        cli, ["import", "journal", "--batch-size", "-1", str(JOURNAL_FILE)]
+    )
+    assert result.exit_code == 2
+    result = runner.invoke(cli, ["import", "documents", "--jobs", "0", str(DOCUMENTS)])
+    assert result.exit_code == 2
 
 
 def test_import_invoices():
@@ -113,6 +171,7 @@ def test_import_invoices():
     assert result.exit_code == 0
     output_string = "Import invoices from kescher/tests/fixtures/invoices_nested..."
     assert output_string in result.output
+    assert "6 new invoices, 0 duplicates skipped." in result.output
     assert len(Document.select()) == 6
     result = runner.invoke(
         cli,
@@ -128,13 +187,47 @@ def test_import_invoices():
     )
     output_string = "Import invoices from kescher/tests/fixtures/invoices_flat..."
     assert output_string in result.output
-    assert len(VirtualBooking.select()) == 12
+    # The flat directory holds the same invoices, which are imported once
+    assert "0 new invoices, 6 duplicates skipped." in result.output
+    assert len(VirtualBooking.select()) == 6
     assert len(Document.select()) == 12
     for doc_name, doc_hash in DOC_HASHES.items():
         for db_doc in Document.select().where(Document.hash == doc_hash):
             assert db_doc.path.endswith(doc_name)
 
 
+def test_import_invoices_cached(monkeypatch):
+    """
+    Asserts that unchanged invoices are not parsed again and that invoices
+    are parsed by parallel jobs as well.
+    """
+    parsed = []
+    importers_parse_invoice = importers.parse_invoice
+
+    def parse_invoice(task):
+        parsed.append(Path(task[0]).name)
+        return importers_parse_invoice(task)
+
+    monkeypatch.setattr(importers, "parse_invoice", parse_invoice)
+    args = ("import", "invoices", "--flat", str(INVOICES_FLAT), "cid", "total_gross")
+    runner = CliRunner()
+    result = runner.invoke(cli, args + ("date",))
+    assert result.exit_code == 0
+    assert "0 new invoices, 6 duplicates skipped." in result.output
+    assert parsed == []
+    invoice_path = INVOICES_FLAT / "1003.2019.Q1.yaml"
+    stat = invoice_path.stat()
+    os.utime(invoice_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    result = runner.invoke(cli, args + ("date",))
+    assert parsed == ["1003.2019.Q1.yaml"]
+    monkeypatch.undo()
+    InvoiceCache.delete().execute()
+    result = runner.invoke(cli, args[:2] + ("--jobs", "2") + args[2:] + ("date",))
+    assert result.exit_code == 0
+    assert "0 new invoices, 6 duplicates skipped." in result.output
+    assert InvoiceCache.select().count() == 6
+
+
 def test_import_document():
     """
     Asserts that document import from a flat directory structure works correctly.
@@ -144,10 +237,73 @@ def test_import_document():
     assert result.exit_code == 0
     output_string = "Importing documents from kescher/tests/fixtures/invoices_flat..."
     assert output_string in result.output
+    assert "0 new documents, 0 extracted, 6 unchanged." in result.output
     assert len(Document.select()) == 12
+    # The flat and nested invoices are copies, which share their content
+    assert DocumentContent.select().count() == 6
     for doc_name, doc_hash in DOC_HASHES.items():
         for db_doc in Document.select().where(Document.hash == doc_hash):
             assert db_doc.path.endswith(doc_name)
+            assert db_doc.content
+            assert len(db_doc.get_paths()) == 2
+
+
+def test_import_documents_parallel():
+    """
+    Asserts that documents are hashed and extracted by parallel jobs as well.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("import", "documents", "--jobs", "2", str(DOCUMENTS)))
+    assert result.exit_code == 0
+    assert len(Document.select()) == 15
+    for document in Document.select().where(Document.path.startswith(str(DOCUMENTS))):
+        assert document.hash == Document.make_hash(document.path)
+        assert document.content
+
+
+def test_import_documents_unchanged(monkeypatch):
+    """
+    Asserts that unchanged documents are not read again, unless they are verified.
+    """
+    hashed = []
+
+    def make_hash(path):
+        hashed.append(path)
+        return DOC_HASHES.get(path.name)
+
+    monkeypatch.setattr(Document, "make_hash", make_hash)
+    runner = CliRunner()
+    result = runner.invoke(cli, ("import", "documents", str(INVOICES_FLAT)))
+    assert result.exit_code == 0
+    assert hashed == []
+    result = runner.invoke(cli, ("import", "documents", "--verify", str(INVOICES_FLAT)))
+    assert result.exit_code == 0
+    assert len(hashed) == 6
+    assert len(Document.select()) == 15
+
+
+def test_search():
+    """
+    Asserts that the full-text search finds journal entries and documents.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("search", "stromomat", "--no-documents"))
+    assert result.exit_code == 0
+    output = result.output.strip().split("\n")
+    assert len(output) == 6
+    assert "┃003│2020-02-03│kescher e.V.   │Stromomat GmbH │" in output[4]
+
+    result = runner.invoke(
+        cli, ("search", "oktober", "--no-journal", "--per-page", "3")
+    )
+    assert result.exit_code == 0
+    assert result.output.count("kescher/tests/fixtures/invoices_") == 3
+    result = runner.invoke(cli, ("search", "oktober", "--no-journal", "--page", "2"))
+    assert result.exit_code == 0
+    assert result.output.count("kescher/tests/fixtures/invoices_") == 0
+
+    result = runner.invoke(cli, ("search", '"stromomat'))
+    assert result.exit_code == 1
 
 
 def test_show_journal_errors():
@@ -160,7 +316,9 @@ def test_show_journal_errors():
         cli, ("show", "journal", "--filter", "sender:Klausi Meyer")
     )
     assert result_char.exit_code == 1
-    assert result_char.output.strip() == "Filter must contain exactly one '='"
+    assert (
+        result_char.output.strip() == "Invalid filter condition 'sender:Klausi Meyer'"
+    )
 
     # Test with invalid filter character
     runner_col = CliRunner()
@@ -193,18 +351,128 @@ def test_show_journal_filtered(journal_filtered_klausi_meyer):
         assert journal_filtered_klausi_meyer[line] in output
 
 
+def journal_ids(output):
+    """
+    Returns the ids of the journal entries in the table output.
+    """
+    return [line[1:4] for line in output.splitlines()[3::2]]
+
+
+def test_show_journal_expression():
+    """
+    Asserts that the conditions of a filter expression are combined.
+    """
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ("show", "journal", "--filter", "date=2020-02-03..2020-02-04 AND value<30"),
+    )
+    assert result.exit_code == 0
+    assert journal_ids(result.output) == ["003", "005", "006"]
+    result = runner.invoke(
+        cli, ("show", "journal", "--filter", "id IN 1,4 AND subject~internet")
+    )
+    assert journal_ids(result.output) == ["001", "004"]
+
+
+def test_show_journal_pages():
+    """
+    Asserts that the journal is paginated by the ids of the entries.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("show", "journal", "--limit", "2"))
+    assert journal_ids(result.output) == ["001", "002"]
+    result = runner.invoke(cli, ("show", "journal", "--limit", "2", "--after-id", "2"))
+    assert journal_ids(result.output) == ["003", "004"]
+    result = runner.invoke(cli, ("show", "journal", "--limit", "2", "--before-id", "5"))
+    assert journal_ids(result.output) == ["003", "004"]
+    result = runner.invoke(
+        cli, ("show", "journal", "--limit", "2", "--before-id", "5", "--order", "desc")
+    )
+    assert journal_ids(result.output) == ["004", "003"]
+    result = runner.invoke(cli, ("show", "journal", "--order", "desc", "--limit", "1"))
+    assert journal_ids(result.output) == ["006"]
+
+
+def test_show_journal_formats():
+    """
+    Asserts that the journal can be shown as CSV, NDJSON and JSON with all
+    columns.
+    """
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ("show", "journal", "--format", "csv", "--filter", "id<3")
+    )
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == 3
+    assert lines[0].startswith("id,updated_at,date,sender,receiver,subject,")
+    assert (
+        ",2020-01-31,Klausi Meyer,kescher e.V.,Internet Betrag NO REFERENCE,"
+        in lines[1]
+    )
+    result = runner.invoke(cli, ("show", "journal", "--format", "ndjson"))
+    entries = [json.loads(line) for line in result.output.splitlines()]
+    assert [entry["value"] for entry in entries] == [
+        "29.00",
+        "-120.10",
+        "-64.50",
+        "39.00",
+        "19.00",
+        "29.00",
+    ]
+    result = runner.invoke(cli, ("show", "journal", "--format", "json"))
+    assert json.loads(result.output) == entries
+
+
+def test_export(tmp_path):
+    """
+    Asserts that tables can be exported to a file.
+    """
+    runner = CliRunner()
+    output = tmp_path / "accounts.ndjson"
+    result = runner.invoke(
+        cli, ("export", "--format", "ndjson", "--output", str(output), "accounts")
+    )
+    assert result.exit_code == 0
+    accounts = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(accounts) == 19
+    assert accounts[0] == {
+        "layer": 0,
+        "name": "Debitoren",
+        "saldo": "0.00",
+        "virtual_saldo": "120.00",
+    }
+    result = runner.invoke(cli, ("export", "--filter", "sender~meyer", "journal"))
+    assert len(result.output.splitlines()) == 2
+    result = runner.invoke(cli, ("export", "--filter", "send=x", "journal"))
+    assert result.exit_code == 1
+    assert result.output.strip() == "send is not a filterable column"
+
+
 def test_auto_vat():
     """
     Asserts the auto-vat command executes without error.
     The results are checked separately with the show_saldo test command.
     """
     runner = CliRunner()
+    result_dry = runner.invoke(
+        cli,
+        ("book", "vat", "--dry-run", "--start", "2020-02-01")
+        + ("19", "USt_Einnahmen", "USt_Ausgaben"),
+    )
+    assert result_dry.exit_code == 0
+    assert "Would book 3 entries with 13.89 to USt_Einnahmen." in result_dry.output
+    assert "Would book 1 entries with 10.30 to USt_Ausgaben." in result_dry.output
     result = runner.invoke(cli, ("book", "vat", "19", "USt_Einnahmen", "USt_Ausgaben"))
     assert result.exit_code == 0
+    assert "Booked 4 entries with 18.52 to USt_Einnahmen." in result.output
     result_again = runner.invoke(
         cli, ("book", "vat", "19", "USt_Einnahmen", "USt_Ausgaben")
     )
     assert result_again.exit_code == 0
+    assert "VAT already booked for 6 entries." in result_again.output
+    assert "Booked 0 entries with 0.00 to USt_Ausgaben." in result_again.output
 
 
 def test_show_saldo():
@@ -243,6 +511,48 @@ def test_show_accounts(expected_accounts):
         assert acc == exp
 
 
+def test_show_accounts_depth_and_range():
+    """
+    Asserts that the account tree can be limited in depth and time frame.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("show", "accounts", "--depth", "0"))
+    assert result.exit_code == 0
+    output = result.output.strip().split("\n")
+    assert output == [
+        "┣━Debitoren \x1b[31m-120.00",
+        "┣━Umsatzsteuer \x1b[32m48.00",
+        "┣━Aufwendungen \x1b[32m0.00",
+        "┣━Erträge \x1b[32m0.00",
+        "┣━1003 \x1b[31m-288.00",
+    ]
+    result = runner.invoke(
+        cli, ("show", "accounts", "--start", "2020-02-01", "--end", "2020-02-29")
+    )
+    assert result.exit_code == 0
+    output = result.output.strip().split("\n")
+    assert output[0] == "┣━Debitoren \x1b[32m0.00"
+    assert output[4] == "┣━Umsatzsteuer \x1b[32m24.19"
+    assert output[5] == "┃ ┣━USt_Einnahmen \x1b[32m13.89"
+
+
+def test_show_accounts_stats(tmp_path):
+    """
+    Asserts that --stats reports the SQL statements of a command, and that
+    the accounts are shown without one query per account.
+    """
+    runner = CliRunner()
+    stats_file = tmp_path / "stats.json"
+    result = runner.invoke(
+        cli, ("--stats", "--stats-file", str(stats_file), "show", "accounts")
+    )
+    assert result.exit_code == 0
+    assert "SQL statements in" in result.output
+    summary = json.loads(stats_file.read_text())
+    assert 0 < summary["queries"]["count"] < 10
+    assert summary["n_plus_one"] == []
+
+
 def test_show_entry(entry_3):
     """
     Asserts, that the filter results matches expectations of content and formatting.
@@ -269,3 +579,268 @@ def test_show_booked_entry(entry_3_booked):
     output = result.output.strip().split("\n")
     for res, exp in zip(output, entry_3_booked):
         assert res == exp
+
+
+def test_show_saldo_subtree():
+    """
+    Asserts that the saldo of an account includes the bookings of all accounts
+    below it, at any depth, within the given time frame.
+    """
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ("create", "account", "--parent", "Kundenhardware", "Router")
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ("book", "entry", "--value", "20", "2", "Router"))
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ("show", "saldo", "Aufwendungen"))
+    assert result.output.strip() == "Saldo is 74.20"
+    result = runner.invoke(cli, ("show", "saldo", "Anschaffungen"))
+    assert result.output.strip() == "Saldo is 20.00"
+    result = runner.invoke(
+        cli,
+        ("show", "saldo", "Aufwendungen")
+        + ("--start", "2020-02-01", "--end", "2020-02-29"),
+    )
+    assert result.output.strip() == "Saldo is 54.20"
+    result = runner.invoke(
+        cli,
+        ("show", "saldo", "Aufwendungen")
+        + ("--start", "2020-02-02", "--end", "2020-02-03"),
+    )
+    assert result.output.strip() == "Saldo is 54.20"
+
+
+def test_rebuild_balances():
+    """
+    Asserts that the balances kept by the triggers are consistent, and that
+    rebuild-balances repairs an inconsistent balance.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("rebuild-balances",))
+    assert result.exit_code == 0
+    assert result.output.strip() == "Rebuilt balances, 0 accounts were inconsistent."
+    router = Account.get(Account.name == "Router")
+    AccountBalance.update(value=Decimal("1.00")).where(
+        AccountBalance.account == router
+    ).execute()
+    result = runner.invoke(cli, ("show", "saldo", "Router"))
+    assert result.output.strip() == "Saldo is 1.00"
+    result = runner.invoke(cli, ("rebuild-balances",))
+    assert result.output.strip() == "Rebuilt balances, 1 accounts were inconsistent."
+    result = runner.invoke(cli, ("show", "saldo", "Router"))
+    assert result.output.strip() == "Saldo is 20.00"
+
+
+def test_close_period():
+    """
+    Asserts that closing a year snapshots the balances, that saldos read the
+    snapshot, and that bookings within a locked year are refused.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("close", "--lock", "2020"))
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "Closed 2020 with balances of 11 accounts.",
+        "Bookings in 2020 are locked.",
+    ]
+    result = runner.invoke(
+        cli, ("show", "saldo", "Aufwendungen", "--end", "2021-01-31")
+    )
+    assert result.output.strip() == "Saldo is 74.20"
+    result = runner.invoke(
+        cli, ("show", "saldo", "Aufwendungen", "--end", "2020-01-31")
+    )
+    assert result.output.strip() == "Saldo is 20.00"
+    result = runner.invoke(cli, ("book", "entry", "--value", "1", "2", "Router"))
+    assert result.exit_code == 1
+    assert "locked period" in result.output
+    result = runner.invoke(cli, ("close", "2020"))
+    assert result.output.strip() == "Closed 2020 with balances of 11 accounts."
+    result = runner.invoke(cli, ("book", "entry", "--value", "1", "2", "Router"))
+    assert result.exit_code == 0
+    result = runner.invoke(
+        cli, ("show", "saldo", "Aufwendungen", "--end", "2021-01-31")
+    )
+    assert result.output.strip() == "Saldo is 75.20"
+    result = runner.invoke(cli, ("rebuild-balances",))
+    assert result.output.strip() == "Rebuilt balances, 0 accounts were inconsistent."
+
+
+def test_migrate():
+    """
+    Asserts that a database created by init is already up to date.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("migrate",))
+    assert result.exit_code == 0
+    assert result.output.strip() == "Database is at version 8."
+
+
+def test_show_unbalanced():
+    """
+    Asserts that unbooked and partially booked entries are shown with the
+    number of entries and the amount left to book.
+    """
+    runner = CliRunner()
+    Booking.delete().where(Booking.journalentry == 5).execute()
+    result = runner.invoke(cli, ("show", "unbalanced"))
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert [line[1:4] for line in lines if line[1:4].isdigit()] == [
+        "001",
+        "002",
+        "004",
+        "005",
+        "006",
+    ]
+    assert lines[-2:] == [
+        "partial: 4 entries, 161.43 left to book.",
+        "unbooked: 1 entries, 19.00 left to book.",
+    ]
+    result = runner.invoke(cli, ("book", "entry", "1", "Internet"))
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ("show", "unbalanced", "--format", "csv"))
+    assert result.output.splitlines() == [
+        "id,sender,receiver,subject,value,booked,status",
+        "2,kescher e.V.,Haus AG,Miete NO REFERENCE,-120.10,40.18,partial",
+        "4,Susanne Wilmer,kescher e.V.,Internet Betrag NO REFERENCE,39.00,6.23,partial",
+        "5,Halmann KG,kescher e.V.,Internet Betrag NO REFERENCE,19.00,0.00,unbooked",
+        "6,Ayten Uzun,kescher e.V.,Internet Betrag NO REFERENCE,29.00,4.63,partial",
+    ]
+    result = runner.invoke(
+        cli, ("export", "--format", "csv", "--filter", "id IN 4,5", "unbalanced")
+    )
+    assert result.exit_code == 0
+    assert [line[:2] for line in result.output.splitlines()] == ["id", "4,", "5,"]
+    result = runner.invoke(
+        cli, ("book", "entry", "--force", "--value", "10", "1", "Internet")
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ("show", "unbalanced"))
+    assert result.output.splitlines()[-3:] == [
+        "overbooked: 1 entries, 10.00 booked too much.",
+        "partial: 3 entries, 137.06 left to book.",
+        "unbooked: 1 entries, 19.00 left to book.",
+    ]
+
+
+def test_startup_imports(tmp_path):
+    """
+    Asserts that importing the cli neither loads the heavy dependencies nor
+    creates the log file, as both slow down every call of kescher.
+    """
+    code = (
+        "import sys, kescher.cli; "
+        + "print(' '.join(m for m in sys.modules if m.split('.')[0] in "
+        + "('arrow', 'colorama', 'pdfminer', 'peewee', 'tqdm', 'yaml')))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(Path.cwd())},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
+    subprocess.run(
+        [sys.executable, "-m", "kescher.cli", "book", "--help"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(Path.cwd())},
+        capture_output=True,
+        check=True,
+    )
+    assert not (tmp_path / "kescher.log").exists()
+
+
+def test_import_bank(tmp_path):
+    """
+    Asserts that a bank export is imported in one pass, with the same
+    entries as if it was sanitized and imported as journal.
+    """
+    runner = CliRunner()
+    result = runner.invoke(cli, ("import", "bank", str(POSTBANK_STATEMENT)))
+    assert result.exit_code == 1
+    assert "please give --bank" in result.output
+    result = runner.invoke(
+        cli,
+        ("import", "bank", "--bank", "postbank", "--reverse", str(POSTBANK_STATEMENT)),
+    )
+    assert result.exit_code == 0
+    assert "10 new entries, 0 duplicates skipped." in result.output
+    assert JournalEntry.select().order_by(JournalEntry.id.desc()).get().sender == (
+        "Katrin Friedmann"
+    )
+    sanitized = tmp_path / "sanitized.csv"
+    runner.invoke(sanitize_postbank, (str(POSTBANK_STATEMENT), str(sanitized)))
+    result = runner.invoke(cli, ("import", "journal", str(sanitized)))
+    assert "0 new entries, 10 duplicates skipped." in result.output
+
+
+def test_import_documents_copies(tmp_path):
+    """
+    Asserts that the text of documents with the same content is extracted
+    and stored once.
+    """
+    pdf = make_pdf(["Rechnung (4711)", "Gesamt 12.00 EUR"])
+    for name in ("4711.pdf", "4711-copy.pdf"):
+        (tmp_path / name).write_bytes(pdf)
+    runner = CliRunner()
+    result = runner.invoke(cli, ("import", "documents", str(tmp_path)))
+    assert result.exit_code == 0
+    assert "2 new documents, 1 extracted, 0 unchanged." in result.output
+    document = Document.get(Document.path == str(tmp_path / "4711.pdf"))
+    assert "Rechnung (4711)" in document.content
+    assert document.get_paths() == [
+        str(tmp_path / "4711-copy.pdf"),
+        str(tmp_path / "4711.pdf"),
+    ]
+    result = runner.invoke(cli, ("search", "4711", "--no-journal"))
+    assert result.output.count("Rechnung (4711)") == 2
+
+
+def test_import_journal_zero_value(tmp_path):
+    """
+    Asserts that entries without value are booked, as there is nothing to book.
+    """
+    journal = tmp_path / "journal.csv"
+    journal.write_text("1.3.2020;kescher e.V.;Bank AG;Kontoauszug;0.00;2500.00\n")
+    runner = CliRunner()
+    result = runner.invoke(cli, ("import", "journal", str(journal)))
+    assert result.exit_code == 0
+    entry = JournalEntry.get(JournalEntry.subject == "Kontoauszug")
+    assert entry.status == "booked"
+    result = runner.invoke(cli, ("show", "unbalanced", "--format", "csv"))
+    assert "Kontoauszug" not in result.output
+
+
+def test_locked_period_skipped(tmp_path):
+    """
+    Asserts that VAT and invoices are not booked within a locked period, but
+    skipped and reported.
+    """
+    invoice = yaml.safe_load((INVOICES_FLAT / "1000.2019.Q3.yaml").read_text())
+    invoice.update({"id": "1000.2020.Q1", "date": "08.03.2020"})
+    invoices = tmp_path / "invoices"
+    invoices.mkdir()
+    (invoices / "1000.2020.Q1.yaml").write_text(yaml.safe_dump(invoice))
+    runner = CliRunner()
+    with benchmark_database(tmp_path / KESCHER_DB):
+        create_tables()
+        runner.invoke(cli, ("import", "accounts", str(ACCOUNTS_FILE)))
+        runner.invoke(cli, ("import", "journal", str(JOURNAL_FILE)))
+        result = runner.invoke(cli, ("close", "--lock", "2020"))
+        assert "Bookings in 2020 are locked." in result.output
+        result = runner.invoke(
+            cli, ("book", "vat", "19", "USt_Einnahmen", "USt_Ausgaben")
+        )
+        assert result.exit_code == 0
+        assert "Skipped 6 entries in locked periods." in result.output
+        assert "Booked 0 entries with 0.00 to USt_Einnahmen." in result.output
+        args = ("import", "invoices", "--flat", str(invoices), "cid", "total_gross")
+        result = runner.invoke(cli, args + ("date",))
+        assert result.exit_code == 0
+        assert "0 new invoices, 0 duplicates skipped." in result.output
+        assert "Skipped 1 invoices in locked periods." in result.output
+        assert VirtualBooking.select().count() == 0
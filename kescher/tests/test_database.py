@@ -0,0 +1,26 @@
+from kescher.database import DEFAULT_PRAGMAS, get_db, get_pragmas
+from kescher.models import BaseModel
+
+
+def test_get_db_shared():
+    """
+    Asserts that the models and the importers share one database, which is
+    in WAL mode.
+    """
+    assert get_db() is get_db()
+    assert BaseModel._meta.database is get_db()
+    assert get_db().execute_sql("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_get_pragmas(tmp_path):
+    """
+    Asserts that the pragmas of the config file override the defaults, and
+    that the environment overrides the config file.
+    """
+    assert get_pragmas(tmp_path / "missing.cfg", {}) == DEFAULT_PRAGMAS
+    config_file = tmp_path / "kescher.cfg"
+    config_file.write_text("[database]\nsynchronous = full\ncache_size = -2000\n")
+    pragmas = get_pragmas(config_file, {"KESCHER_CACHE_SIZE": "-4000"})
+    assert pragmas["synchronous"] == "full"
+    assert pragmas["cache_size"] == "-4000"
+    assert pragmas["journal_mode"] == "wal"
@@ -0,0 +1,54 @@
+import io
+import json
+import pytest
+
+from datetime import date
+from decimal import Decimal
+from kescher.export import write_rows
+
+COLUMNS = ("id", "date", "subject", "value")
+ROWS = (
+    (1, date(2020, 1, 31), "Internet, Januar", Decimal("29")),
+    (2, date(2020, 2, 3), "Strom", Decimal("-64.499999999")),
+)
+
+
+def export(format_):
+    out = io.StringIO()
+    write_rows(COLUMNS, iter(ROWS), out, format_)
+    return out.getvalue()
+
+
+def test_write_csv():
+    assert export("csv").splitlines() == [
+        "id,date,subject,value",
+        '1,2020-01-31,"Internet, Januar",29.00',
+        "2,2020-02-03,Strom,-64.50",
+    ]
+
+
+def test_write_ndjson():
+    lines = export("ndjson").splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {
+            "id": 1,
+            "date": "2020-01-31",
+            "subject": "Internet, Januar",
+            "value": "29.00",
+        },
+        {"id": 2, "date": "2020-02-03", "subject": "Strom", "value": "-64.50"},
+    ]
+
+
+def test_write_json():
+    assert json.loads(export("json")) == [
+        json.loads(line) for line in export("ndjson").splitlines()
+    ]
+    out = io.StringIO()
+    write_rows(COLUMNS, iter(()), out, "json")
+    assert json.loads(out.getvalue()) == []
+
+
+def test_write_unknown_format():
+    with pytest.raises(ValueError):
+        export("xml")
@@ -0,0 +1,91 @@
+import pytest
+
+from datetime import date
+from decimal import Decimal
+from kescher.filters import parse_filter
+from kescher.models import Booking, JournalEntry
+from peewee import SqliteDatabase
+
+
+def compile_filter(model, filter_):
+    return model.select(model.id).where(parse_filter(model, filter_)).sql()
+
+
+def test_parse_filter():
+    """
+    Asserts that the conditions are compiled to parameters of the types of
+    the columns.
+    """
+    sql, params = compile_filter(
+        JournalEntry,
+        "date=2020-01-01..2020-01-31 AND value>=-100.5 AND sender!=Haus AG",
+    )
+    assert params == [
+        date(2020, 1, 1),
+        date(2020, 1, 31),
+        Decimal("-100.5"),
+        "Haus AG",
+    ]
+    assert sql.count(" AND ") == 3
+    sql, params = compile_filter(Booking, "journalentry_id IN 1, 2,3")
+    assert '"t1"."journalentry_id" IN (?, ?, ?)' in sql
+    assert params == [1, 2, 3]
+    sql, params = compile_filter(JournalEntry, "value=..0")
+    assert params == [Decimal("0")]
+
+
+def test_parse_filter_and_in_value():
+    """
+    Asserts that only the upper case AND joins conditions.
+    """
+    sql, params = compile_filter(JournalEntry, "subject~Strom and Gas AND value<0")
+    assert params == ["%Strom and Gas%", Decimal("0")]
+
+
+def test_parse_filter_like_wildcards():
+    """
+    Asserts that % and _ are matched literally by ~.
+    """
+    sql, params = compile_filter(JournalEntry, r"subject~100% _\x")
+    assert "ESCAPE" in sql
+    assert params == [r"%100\% \_\\x%"]
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx([JournalEntry]):
+        database.create_tables([JournalEntry])
+        for subject in ("Rabatt 100%", "Rabatt 1000", "a_b", "axb"):
+            JournalEntry.create(
+                date=date(2020, 1, 1),
+                sender="Haus AG",
+                receiver="kescher e.V.",
+                subject=subject,
+                value=1,
+                balance=1,
+                imported_at=date(2020, 1, 1),
+            )
+        for filter_, expected in (
+            ("subject~100%", ["Rabatt 100%"]),
+            ("subject~a_b", ["a_b"]),
+            ("subject~RABATT", ["Rabatt 100%", "Rabatt 1000"]),
+        ):
+            assert [
+                entry.subject
+                for entry in JournalEntry.select()
+                .where(parse_filter(JournalEntry, filter_))
+                .order_by(JournalEntry.id)
+            ] == expected
+
+
+@pytest.mark.parametrize(
+    "filter_, message",
+    (
+        ("sender", "Invalid filter condition 'sender'"),
+        ("select=1", "select is not a filterable column"),
+        ("date<2020-13-01", "Invalid value '2020-13-01' for column date"),
+        ("value=1..x", "Invalid value 'x' for column value"),
+        ("value=..", "Invalid filter condition 'value=..'"),
+    ),
+)
+def test_parse_filter_errors(filter_, message):
+    with pytest.raises(ValueError) as error:
+        parse_filter(JournalEntry, filter_)
+    assert str(error.value) == message
@@ -0,0 +1,84 @@
+import yaml
+
+from kescher.benchmarks import run_benchmarks, time_account_import, time_startup
+from kescher.database import KESCHER_DB_NAME, get_db
+from kescher.generators import (
+    generate_accounts,
+    generate_invoices,
+    generate_journal,
+    make_pdf,
+)
+from kescher.importers import JournalImporter
+from pdfminer.high_level import extract_text
+
+
+def test_generate_journal(tmp_path):
+    """
+    Asserts that the journal is deterministic and in the sanitized format.
+    """
+    generate_journal(tmp_path / "first.csv", 100, seed=1)
+    generate_journal(tmp_path / "second.csv", 100, seed=1)
+    lines = (tmp_path / "first.csv").read_text().splitlines()
+    assert (tmp_path / "second.csv").read_text().splitlines() == lines
+    assert len(lines) == 100
+    for line in lines:
+        JournalImporter._parse_row(line.split(";"))
+
+
+def test_generate_accounts(tmp_path):
+    leaves = generate_accounts(tmp_path / "accounts.yaml", 3, 2, n_customers=5)
+    assert len(leaves) == 8
+    with open(tmp_path / "accounts.yaml") as account_file:
+        accounts = yaml.safe_load(account_file)
+    assert accounts["Debitoren"] == ["1000", "1001", "1002", "1003", "1004"]
+    assert accounts["Aufwendungen"][1] == {
+        "Aufwand.1": [
+            {"Aufwand.1.0": ["Aufwand.1.0.0", "Aufwand.1.0.1"]},
+            {"Aufwand.1.1": ["Aufwand.1.1.0", "Aufwand.1.1.1"]},
+        ]
+    }
+
+
+def test_generate_invoices(tmp_path):
+    generate_invoices(tmp_path, 5, n_customers=2)
+    assert len(list(tmp_path.glob("*/*.yaml"))) == 5
+    assert len(list(tmp_path.glob("*/*.pdf"))) == 5
+
+
+def test_make_pdf(tmp_path):
+    pdf_path = tmp_path / "test.pdf"
+    pdf_path.write_bytes(make_pdf(["Rechnung (1)", "Gesamt 12.00 EUR"]))
+    assert extract_text(str(pdf_path)).split("\n")[:2] == [
+        "Rechnung (1)",
+        "Gesamt 12.00 EUR",
+    ]
+
+
+def test_run_benchmarks(tmp_path):
+    """
+    Asserts that all steps are timed and that the database of the current
+    working directory is used again afterwards.
+    """
+    timings = run_benchmarks(200, tmp_path)
+    assert set(timings) == {
+        "import_accounts",
+        "import_journal",
+        "import_documents",
+        "import_invoices",
+        "book_vat",
+        "generate_bookings",
+        "get_account_saldo",
+        "get_account_saldo_range",
+        "show_accounts",
+        "show_unbalanced",
+    }
+    assert get_db().database == KESCHER_DB_NAME
+
+
+def test_time_startup():
+    assert 0 < time_startup(("--help",), repeat=1) < 10
+
+
+def test_time_account_import(tmp_path):
+    assert 0 < time_account_import(tmp_path, depth=2, breadth=3) < 10
+    assert get_db().database == KESCHER_DB_NAME
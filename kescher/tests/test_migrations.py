@@ -0,0 +1,200 @@
+import zlib
+
+from datetime import date
+from kescher.benchmarks import benchmark_database
+from click.testing import CliRunner
+from kescher.cli import cli
+from kescher.filters import DocumentSearchFilter
+from kescher.migrations import MIGRATIONS, migrate_database, migrate_document_content
+from kescher.models import Document, JournalEntry, create_tables
+from peewee import SqliteDatabase
+
+# The tables as created by the first version of kescher
+BASELINE_SCHEMA = (
+    'CREATE TABLE "account" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    + '"updated_at" DATETIME, "name" VARCHAR(255) NOT NULL, "parent_id" INTEGER, '
+    + 'FOREIGN KEY ("parent_id") REFERENCES "account" ("id"))',
+    'CREATE INDEX "account_parent_id" ON "account" ("parent_id")',
+    'CREATE UNIQUE INDEX "account_name_parent_id" ON "account" ("name", "parent_id")',
+    'CREATE TABLE "document" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    + '"updated_at" DATETIME, "content" TEXT NOT NULL, '
+    + '"path" VARCHAR(255) NOT NULL, "hash" VARCHAR(255) NOT NULL)',
+    'CREATE UNIQUE INDEX "document_path" ON "document" ("path")',
+    'CREATE TABLE "journalentry" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    + '"updated_at" DATETIME, "date" DATE NOT NULL, "sender" VARCHAR(255) NOT NULL, '
+    + '"receiver" VARCHAR(255) NOT NULL, "subject" VARCHAR(255) NOT NULL, '
+    + '"document_id" INTEGER, "value" DECIMAL(10, 5) NOT NULL, '
+    + '"balance" DECIMAL(10, 5) NOT NULL, "imported_at" DATETIME NOT NULL, '
+    + 'FOREIGN KEY ("document_id") REFERENCES "document" ("id"))',
+    'CREATE INDEX "journalentry_document_id" ON "journalentry" ("document_id")',
+    'CREATE TABLE "booking" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    + '"updated_at" DATETIME, "account_id" INTEGER NOT NULL, '
+    + '"journalentry_id" INTEGER NOT NULL, "comment" VARCHAR(255), '
+    + '"value" DECIMAL(10, 5) NOT NULL, '
+    + 'FOREIGN KEY ("account_id") REFERENCES "account" ("id"), '
+    + 'FOREIGN KEY ("journalentry_id") REFERENCES "journalentry" ("id"))',
+    'CREATE INDEX "booking_account_id" ON "booking" ("account_id")',
+    'CREATE INDEX "booking_journalentry_id" ON "booking" ("journalentry_id")',
+    'CREATE TABLE "virtualbooking" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    + '"updated_at" DATETIME, "account_id" INTEGER NOT NULL, "date" DATE NOT NULL, '
+    + '"document_id" INTEGER, "comment" VARCHAR(255), '
+    + '"value" DECIMAL(10, 5) NOT NULL, '
+    + 'FOREIGN KEY ("account_id") REFERENCES "account" ("id"), '
+    + 'FOREIGN KEY ("document_id") REFERENCES "document" ("id"))',
+    'CREATE INDEX "virtualbooking_account_id" ON "virtualbooking" ("account_id")',
+    'CREATE INDEX "virtualbooking_document_id" ON "virtualbooking" ("document_id")',
+)
+
+
+def test_migrate_document_content(tmp_path):
+    """
+    Asserts that the content of documents in a database of an earlier version
+    is moved to compressed storage.
+    """
+    database = SqliteDatabase(str(tmp_path / "kescher.db"))
+    database.execute_sql(
+        "CREATE TABLE document (id INTEGER PRIMARY KEY, updated_at DATETIME, "
+        + "content TEXT NOT NULL, path VARCHAR(255) NOT NULL, hash VARCHAR(255) NOT NULL)"
+    )
+    for doc_id in range(1, 11):
+        database.execute_sql(
+            "INSERT INTO document (id, content, path, hash) VALUES (?, ?, ?, ?)",
+            (doc_id, "Rechnung Internet " * 1000, f"{doc_id}.pdf", "0" * 64),
+        )
+
+    assert migrate_document_content(database) == 10
+    columns = [column.name for column in database.get_columns("document")]
+    assert "content" not in columns
+    text = database.execute_sql(
+        "SELECT text FROM documentcontent WHERE document_id = 3"
+    ).fetchone()[0]
+    assert zlib.decompress(text).decode() == "Rechnung Internet " * 1000
+    assert migrate_document_content(database) == 0
+
+
+def test_migrate_database(tmp_path):
+    """
+    Asserts that all migrations are applied once to a database of the first
+    version, s.t. the tables of the current models can be created, and that a
+    new database is only marked as up to date.
+    """
+    with benchmark_database(tmp_path / "kescher.db") as database:
+        for statement in BASELINE_SCHEMA:
+            database.execute_sql(statement)
+        database.execute_sql("INSERT INTO account (id, name) VALUES (1, 'Internet')")
+        database.execute_sql(
+            "INSERT INTO journalentry "
+            + "(id, date, sender, receiver, subject, value, balance, imported_at) "
+            + "VALUES (1, '2020-01-31', 'kescher e.V.', 'Klausi Meyer', 'Internet', "
+            + "-120.10, 2545.10, '2020-02-01 10:00:00'), "
+            + "(2, '2020-01-31', 'Klausi Meyer', 'kescher e.V.', 'Internet', "
+            + "29.00, 2574.10, '2020-02-01 10:00:00'), "
+            + "(3, '2020-01-31', 'Klausi Meyer', 'kescher e.V.', 'Internet', "
+            + "29.00, 2574.10, '2020-02-01 10:00:00'), "
+            + "(4, '2020-01-31', 'kescher e.V.', 'Klausi Meyer', 'Internet', "
+            + "-120.10, 2545.10, '2020-03-01 10:00:00')"
+        )
+        database.execute_sql(
+            "INSERT INTO booking (account_id, journalentry_id, value) "
+            + "VALUES (1, 1, 100)"
+        )
+        # The id of the invoice differs from the name of its file, the copy
+        # has no invoice file
+        invoice_path = tmp_path / "invoices" / "1000" / "rechnung_3.pdf"
+        invoice_path.parent.mkdir(parents=True)
+        invoice_path.with_suffix(".yaml").write_text("id: 1000.2019.Q3\n")
+        database.execute_sql(
+            "INSERT INTO document (id, content, path, hash) "
+            + "VALUES (1, 'Rechnung', ?, 'abc'), "
+            + "(2, 'Rechnung', 'copies/1000.2019.Q3.pdf', 'abc')",
+            (str(invoice_path),),
+        )
+        database.execute_sql(
+            "INSERT INTO virtualbooking (account_id, document_id, date, value) "
+            + "VALUES (1, 1, '2019-12-08', 60), (1, 1, '2019-12-08', 60), "
+            + "(1, NULL, '2019-12-08', 10), (1, 2, '2019-12-08', 60)"
+        )
+
+        applied = migrate_database(database)
+        assert list(applied) == [
+            "migrate_document_content",
+            "add_fingerprints",
+            "add_document_signatures",
+            "create_indexes",
+            "add_booked_status",
+            "add_invoice_ids",
+            "address_document_content",
+            "slim_document_index",
+        ]
+        assert applied["migrate_document_content"] == 2
+        assert database.user_version == len(MIGRATIONS)
+        indexes = [index.name for index in database.get_indexes("virtualbooking")]
+        assert "virtualbooking_account_id_date_value" in indexes
+        assert "journalentry_date" in [
+            index.name for index in database.get_indexes("journalentry")
+        ]
+        assert database.execute_sql(
+            "SELECT booked, status FROM journalentry ORDER BY id"
+        ).fetchall() == [
+            (100, "partial"),
+            (0, "unbooked"),
+            (0, "unbooked"),
+            (0, "unbooked"),
+        ]
+        assert database.execute_sql(
+            "SELECT invoice FROM virtualbooking ORDER BY id"
+        ).fetchall() == [("1000.2019.Q3",), (None,), (None,), (None,)]
+        assert database.execute_sql("SELECT hash FROM documentcontent").fetchall() == [
+            ("abc",)
+        ]
+        assert "document_hash" in [
+            index.name for index in database.get_indexes("document")
+        ]
+        assert migrate_database(database) == {}
+        create_tables()
+        # Identical rows of one import are told apart, the row imported again
+        # is not fingerprinted
+        first = ("kescher e.V.", "Klausi Meyer", "Internet", "-120.10", "2545.10")
+        second = ("Klausi Meyer", "kescher e.V.", "Internet", "29.00", "2574.10")
+        assert [
+            entry.fingerprint
+            for entry in JournalEntry.select().order_by(JournalEntry.id)
+        ] == [
+            JournalEntry.make_fingerprint(date(2020, 1, 31), *first, 1),
+            JournalEntry.make_fingerprint(date(2020, 1, 31), *second, 1),
+            JournalEntry.make_fingerprint(date(2020, 1, 31), *second, 2),
+            None,
+        ]
+        assert Document.get_by_id(1).content == "Rechnung"
+        # The full-text index reads the texts from documentcontent
+        assert "documentindex_content" not in database.get_tables()
+        assert [
+            row[0] for row in DocumentSearchFilter()("Rechnung", 80, header=False)
+        ] == ["001", "002"]
+        assert Document.get_by_id(1).size is None
+
+
+def test_migrate_saves_space(tmp_path):
+    """
+    Asserts that migrate reports the bytes saved by compressing the texts,
+    with the full-text index built again.
+    """
+    with benchmark_database(tmp_path / "kescher.db") as database:
+        for statement in BASELINE_SCHEMA:
+            database.execute_sql(statement)
+        for i in range(100):
+            database.execute_sql(
+                "INSERT INTO document (content, path, hash) VALUES (?, ?, ?)",
+                ("Rechnung Internet " * 1000, f"invoices/{i}.pdf", str(i)),
+            )
+        result = CliRunner().invoke(cli, ("migrate",))
+        assert result.exit_code == 0
+        line = result.output.splitlines()[-2]
+        assert line.startswith("Migrated content of 100 documents, saved ")
+        assert int(line.split()[-2]) > 0
+
+
+def test_migrate_new_database(tmp_path):
+    new_database = SqliteDatabase(str(tmp_path / "new.db"))
+    assert migrate_database(new_database) == {}
+    assert new_database.user_version == len(MIGRATIONS)
@@ -0,0 +1,14 @@
+from datetime import date
+from kescher.models import JournalEntry
+
+
+def test_journalentry_fingerprint():
+    """
+    Asserts that the fingerprint does not depend on the notation of the
+    amounts, but on the occurrence of the row within the statement.
+    """
+    row = (date(2020, 1, 31), "Klausi Meyer", "kescher e.V.", "Internet")
+    first = JournalEntry.make_fingerprint(*row, "29.00", "2545.10", 1)
+    assert first == JournalEntry.make_fingerprint(*row, "29", "2545.1", 1)
+    assert first != JournalEntry.make_fingerprint(*row, "29.00", "2545.10", 2)
+    assert first != JournalEntry.make_fingerprint(*row, "-29.00", "2545.10", 1)
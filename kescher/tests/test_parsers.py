@@ -0,0 +1,70 @@
+import pytest
+
+from datetime import date
+from decimal import Decimal
+from kescher.parsers import (
+    CsvHeaderError,
+    PostBankCsvParser,
+    detect_parser,
+    iter_reversed,
+)
+from pathlib import Path
+
+POSTBANK_STATEMENT = Path(
+    "kescher/tests/fixtures/sanitizers/"
+    "Umsatzauskunft_KtoNr01234567890_03-01-2020_17-18-19.csv"
+)
+
+
+def postbank_export(tmp_path):
+    """
+    Returns the path of the PostBank statement, with a preamble and header.
+    """
+    export_path = tmp_path / "export.csv"
+    header = ";".join(f'"{column}"' for column in PostBankCsvParser.expected_header)
+    export_path.write_bytes(
+        '"Umsatzauskunft"\n\n'.encode("latin3")
+        + header.encode("latin3")
+        + b"\n"
+        + POSTBANK_STATEMENT.read_bytes()
+    )
+    return export_path
+
+
+def test_amount_to_decimal():
+    parser = PostBankCsvParser()
+    assert parser.amount_to_decimal("92.690,05 \x80") == Decimal("92690.05")
+    assert parser.amount_to_decimal("-1.234.567,8 €") == Decimal("-1234567.80")
+    assert parser.amount_to_decimal("0,1") == Decimal("0.10")
+
+
+def test_detect_parser(tmp_path):
+    """
+    Asserts that the bank is detected by the header, and that the rows
+    after the header are read.
+    """
+    with pytest.raises(CsvHeaderError):
+        detect_parser(POSTBANK_STATEMENT)
+    export_path = postbank_export(tmp_path)
+    parser = detect_parser(export_path)
+    assert parser.name == "postbank"
+    with open(export_path, encoding=parser.encoding, newline="") as export:
+        rows = list(parser.iter_rows(export))
+    assert len(rows) == 10
+    assert parser.get_journal_entry(rows[0]) == (
+        date(2020, 1, 3),
+        "Katrin Friedmann",
+        "kescher e.V.",
+        "Internet XXX",
+        Decimal("20.00"),
+        Decimal("92690.05"),
+    )
+
+
+def test_iter_reversed():
+    """
+    Asserts that rows are reversed across the chunks they are spilled in.
+    """
+    rows = [[str(n), "a;b", "c\r\nd"] for n in range(10)]
+    assert list(iter_reversed(rows, chunk_rows=3)) == rows[::-1]
+    assert list(iter_reversed([])) == []
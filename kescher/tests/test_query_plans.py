@@ -0,0 +1,120 @@
+"""
+This module asserts that the core queries are answered with indexes, i.e.
+that EXPLAIN QUERY PLAN does not report a scan of a table.
+"""
+import pytest
+
+from datetime import date
+from kescher.booking import date_range, sum_bookings, sum_virtual_bookings
+from kescher.filters import UnbalancedFilter
+from kescher.models import (
+    Account,
+    AccountBalance,
+    AccountClosure,
+    AccountMonthBalance,
+    BalanceSnapshot,
+    Booking,
+    ClosedPeriod,
+    Document,
+    DocumentContent,
+    JournalEntry,
+    VirtualBooking,
+)
+from peewee import SqliteDatabase
+
+MODELS = [
+    Document,
+    DocumentContent,
+    JournalEntry,
+    Account,
+    AccountClosure,
+    Booking,
+    VirtualBooking,
+    AccountBalance,
+    AccountMonthBalance,
+    ClosedPeriod,
+    BalanceSnapshot,
+]
+
+START = date(2020, 1, 1)
+END = date(2020, 1, 31)
+
+
+@pytest.fixture
+def database():
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        yield database
+
+
+def query_plan(database, query):
+    sql, params = query.sql()
+    return [row[3] for row in database.execute_sql("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def assert_indexed(database, query):
+    plan = query_plan(database, query)
+    assert plan
+    for step in plan:
+        assert not step.startswith("SCAN"), plan
+    return "\n".join(plan)
+
+
+def test_sum_bookings_plan(database):
+    plan = assert_indexed(database, sum_bookings([1, 2], START, END))
+    assert "COVERING INDEX booking_account_id_journalentry_id_value" in plan
+
+
+def test_sum_virtual_bookings_plan(database):
+    plan = assert_indexed(database, sum_virtual_bookings([1, 2], START, END))
+    assert "COVERING INDEX virtualbooking_account_id_date_value" in plan
+
+
+def test_journal_date_range_plan(database):
+    assert_indexed(
+        database,
+        JournalEntry.select().where(date_range(JournalEntry.date, START, END)),
+    )
+
+
+def test_virtual_booking_date_range_plan(database):
+    assert_indexed(
+        database,
+        VirtualBooking.select().where(date_range(VirtualBooking.date, START, END)),
+    )
+
+
+def test_month_balance_plan(database):
+    assert_indexed(
+        database,
+        AccountMonthBalance.select().where(
+            (AccountMonthBalance.account == 1)
+            & date_range(AccountMonthBalance.month, START, END)
+        ),
+    )
+
+
+def test_closed_period_plan(database):
+    assert_indexed(
+        database,
+        ClosedPeriod.select()
+        .where(ClosedPeriod.end_date <= END)
+        .order_by(ClosedPeriod.end_date.desc()),
+    )
+
+
+def test_journal_fingerprint_plan(database):
+    assert_indexed(
+        database, JournalEntry.select().where(JournalEntry.fingerprint == "0" * 64)
+    )
+
+
+def test_unbalanced_plan(database):
+    plan = assert_indexed(database, UnbalancedFilter().select())
+    assert "INDEX journalentry_status" in plan
+
+
+def test_document_hash_plan(database):
+    plan = assert_indexed(database, Document.select().where(Document.hash == "0" * 64))
+    assert "INDEX document_hash" in plan
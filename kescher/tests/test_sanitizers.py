@@ -34,3 +34,16 @@ def test_sanitize_postbank_regular(tmp_path):
 
     for l, line in enumerate(golden_master):
         assert line == sanitized[l]
+
+
+def test_sanitize_postbank_reverse(tmp_path):
+    outfilename = tmp_path / "Umsatzauskunft_sanitized.csv"
+    runner = CliRunner()
+    result = runner.invoke(
+        sanitize_postbank, ("--reverse", str(POSTBANK_STATEMENT), str(outfilename))
+    )
+    assert result.exit_code == 0
+    with open(POSTBANK_GOLDEN_MASTER) as infile:
+        golden_master = infile.read().splitlines()
+    with open(outfilename) as outfile:
+        assert outfile.read().splitlines() == golden_master[::-1]
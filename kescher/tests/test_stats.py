@@ -0,0 +1,48 @@
+from kescher import stats
+from kescher.database import KescherDatabase
+
+
+def test_collect_statements():
+    """
+    Asserts that statements are counted by their shape and that a SELECT
+    repeated for many rows is reported as N+1 pattern.
+    """
+    database = KescherDatabase(":memory:")
+    database.execute_sql("SELECT 1")
+    with stats.collect() as collected:
+        for n in range(stats.N_PLUS_ONE_THRESHOLD):
+            database.execute_sql("SELECT ?", (n,))
+        database.execute_sql("SELECT 1 WHERE 1 IN (?, ?, ?)", (1, 2, 3))
+        database.execute_sql("SELECT 1 WHERE 1 IN (?, ?)", (1, 2))
+    assert stats.get_stats() is None
+    summary = collected.summary()
+    assert summary["queries"]["count"] == stats.N_PLUS_ONE_THRESHOLD + 2
+    assert [s["count"] for s in summary["queries"]["statements"]].count(2) == 1
+    assert summary["n_plus_one"] == ["SELECT ?"]
+
+
+def test_normalize():
+    assert (
+        stats.normalize('INSERT INTO "t" ("a", "b") VALUES (?, ?), (?, ?), (?, ?)')
+        == 'INSERT INTO "t" ("a", "b") VALUES (?, ...), ...'
+    )
+
+
+def test_stages():
+    """
+    Asserts that stages are only recorded while collecting.
+    """
+    with stats.stage("parse"):
+        pass
+    rows = [1, 2, 3]
+    assert stats.timed("parse", rows) is rows
+    with stats.collect() as collected:
+        with stats.stage("insert"):
+            pass
+        assert list(stats.timed("parse", rows)) == rows
+        stats.add_stage("hash", 0.5)
+    assert collected.summary()["stages"] == {
+        "insert": {"count": 1, "seconds": 0.0},
+        "parse": {"count": 3, "seconds": 0.0},
+        "hash": {"count": 1, "seconds": 0.5},
+    }